@@ -5,12 +5,44 @@ This is the main entry point for the Sales Training AI application.
 The app uses Flask with a SQLite database for storing user data and conversations.
 """
 import os
+import time
+import orjson
 from datetime import datetime
-import secrets
-from flask import Flask, render_template, g, session, redirect, url_for
-from flask_login import LoginManager
+from sqlalchemy import event
+from sqlalchemy.orm import raiseload
+from jinja2 import FileSystemBytecodeCache
+from flask import Flask, Response, render_template, g, session, redirect, url_for
+from flask_login import LoginManager, current_user
+from flask_session import Session
 from config_manager import config
 from models import db, User
+from redis_client import redis_client
+from auth_security import generate_csrf_token, pooled_token_hex
+
+# Stand-ins for per-request values in pre-rendered pages
+_PAGE_PLACEHOLDERS = {
+    'csp_nonce': '__CSP_NONCE__',
+    'csrf_token': '__CSRF_TOKEN__',
+    'current_year': '__CURRENT_YEAR__',
+    'retry_after': '__RETRY_AFTER__',
+}
+
+# Cached (year, expires_at) for the footer copyright year
+_year_cache = [0, 0]
+
+def current_year():
+    """Get the current year, re-reading the clock at most once an hour."""
+    now = time.time()
+    if now > _year_cache[1]:
+        _year_cache[:] = [datetime.now().year, now + 3600]
+    return _year_cache[0]
+
+def raise_on_lazy_load(orm_execute_state):
+    """Make relationships not eager-loaded by a query raise instead of lazy loading."""
+    if (orm_execute_state.is_select
+            and not orm_execute_state.is_column_load
+            and not orm_execute_state.is_relationship_load):
+        orm_execute_state.statement = orm_execute_state.statement.options(raiseload('*'))
 
 def create_app():
     """Create and configure Flask application."""
@@ -18,16 +50,48 @@ def create_app():
     # Create and configure app
     app = Flask(__name__)
     
+    # Keep compiled templates on disk so restarted workers skip recompiling
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+    
     # Load configuration
-    app.config['SECRET_KEY'] = config.get('FLASK_SECRET_KEY') or secrets.token_hex(32)
+    app.config['SECRET_KEY'] = config.get('FLASK_SECRET_KEY')
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///salestrainer.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 30,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+        'query_cache_size': 1200,
+        # JSON columns (user stats) are encoded and decoded with orjson
+        'json_serializer': lambda value: orjson.dumps(value).decode(),
+        'json_deserializer': orjson.loads,
+        # Writers wait up to 30s for SQLite's write lock instead of failing
+        'connect_args': {'check_same_thread': False, 'timeout': 30}
+    }
     app.config['SESSION_COOKIE_SECURE'] = config.get('SESSION_COOKIE_SECURE', True)
     app.config['SESSION_COOKIE_HTTPONLY'] = True
     app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
     
+    # Keep session data in Redis; the cookie only carries the signed session id
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis_client
+    app.config['SESSION_USE_SIGNER'] = True
+    app.config['SESSION_KEY_PREFIX'] = 'session:'
+    
     # Initialize extensions
     db.init_app(app)
+    Session(app)
+    
+    # Log N+1 lazy-load queries during development
+    if config.get('FLASK_DEBUG', False):
+        from nplusone.ext.flask_sqlalchemy import NPlusOne
+        NPlusOne(app)
+    
+    # Turn accidental lazy loads into errors in tests and opt-in dev runs
+    if app.config.get('TESTING') or config.get('RAISE_ON_LAZY_LOAD', False):
+        event.listen(db.session, 'do_orm_execute', raise_on_lazy_load)
     
     # Initialize login manager
     login_manager = LoginManager()
@@ -36,16 +100,16 @@ def create_app():
     
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        # Flask-Login memoizes the result on g for the rest of the request;
+        # session.get also skips the query if the user is already in the session
+        return db.session.get(User, int(user_id))
     
     # Generate CSRF token for all requests
     @app.before_request
     def before_request():
-        if '_csrf_token' not in session:
-            session['_csrf_token'] = secrets.token_hex(16)
-        g.csrf_token = session['_csrf_token']
-        g.csp_nonce = secrets.token_hex(16)
-        g.current_year = datetime.now().year
+        g.csrf_token = generate_csrf_token()
+        g.csp_nonce = pooled_token_hex()
+        g.current_year = current_year()
     
     # Register blueprints
     from auth_routes import auth as auth_blueprint
@@ -54,23 +118,63 @@ def create_app():
     from chat_routes import chat as chat_blueprint
     app.register_blueprint(chat_blueprint)
     
+    # Pages with no per-request data besides the placeholders, rendered once
+    page_cache = {}
+    
+    def render_cached_page(template_name, status=200):
+        """Serve a pre-rendered page, filling in this request's placeholder values."""
+        body = page_cache.get(template_name)
+        if body is None:
+            request_values = {name: g.get(name) for name in _PAGE_PLACEHOLDERS}
+            for name, placeholder in _PAGE_PLACEHOLDERS.items():
+                setattr(g, name, placeholder)
+            try:
+                body = page_cache[template_name] = render_template(
+                    template_name, retry_after=g.retry_after
+                ).encode()
+            finally:
+                for name, value in request_values.items():
+                    setattr(g, name, value)
+        
+        for name, placeholder in _PAGE_PLACEHOLDERS.items():
+            body = body.replace(placeholder.encode(), str(g.get(name)).encode())
+        
+        return Response(body, status=status, mimetype='text/html')
+    
     # Root route
     @app.route('/')
     def index():
-        return render_template('landing.html')
+        # The nav and flash messages vary for logged-in users and pending flashes
+        if current_user.is_authenticated or session.get('_flashes'):
+            return render_template('landing.html')
+        return render_cached_page('landing.html')
     
     # Error handlers
     @app.errorhandler(404)
     def page_not_found(e):
-        return render_template('404.html'), 404
+        return render_cached_page('errors/404.html', 404)
     
     @app.errorhandler(500)
     def internal_server_error(e):
-        return render_template('500.html'), 500
+        return render_cached_page('errors/500.html', 500)
+    
+    @app.errorhandler(403)
+    def forbidden(e):
+        return render_cached_page('errors/403.html', 403)
     
     @app.errorhandler(429)
     def too_many_requests(e):
-        return render_template('429.html'), 429
+        # rate_limit leaves the wait for the route's own window on g
+        g.retry_after = str(int(g.get('retry_after') or config.get('RATE_LIMIT_WINDOW', 60)))
+        response = render_cached_page('errors/429.html', 429)
+        response.headers['Retry-After'] = g.retry_after
+        return response
+    
+    # Render the error pages now so serving one never goes through Jinja,
+    # including a 500 raised while the app is in a bad state
+    with app.test_request_context():
+        for template_name in ('errors/403.html', 'errors/404.html', 'errors/429.html', 'errors/500.html'):
+            render_cached_page(template_name)
     
     return app
 
@@ -87,7 +191,7 @@ if __name__ == '__main__':
     if not os.path.exists('instance/salestrainer.db'):
         setup_database(app)
     
-    # Run the application
+    # Run the development server (use gunicorn.conf.py in production)
     app.run(
         host=config.get('FLASK_HOST', '0.0.0.0'),
         port=int(config.get('FLASK_PORT', '5000')),
@@ -5,31 +5,150 @@ This module provides routes for user registration, login, and logout.
 It also includes Google OAuth integration.
 """
 import os
-from flask import Blueprint, render_template, redirect, url_for, request, flash, session, jsonify, g
-from werkzeug.security import generate_password_hash, check_password_hash
+import time
+import json
+import random
+import hashlib
+import logging
+from collections import namedtuple
+import redis
+import orjson
+from sqlalchemy import or_, case, exists
+from flask import Blueprint, Response, current_app, render_template, redirect, url_for, request, flash, session, g
 from flask_login import login_user, logout_user, login_required, current_user
-from models import db, User
-from auth_security import validate_password, check_rate_limit, record_failed_login, record_successful_login, csrf_required, rate_limit
+from models import db, User, verify_password_hash, password_needs_rehash, dummy_password_hash
+from config_manager import config
+from auth_security import validate_password, check_rate_limit, check_login_attempts, record_failed_login, record_successful_login, csrf_required, rate_limit
+from redis_client import redis_client
 
-# OAuth for Google login
-from authlib.integrations.flask_client import OAuth
+logger = logging.getLogger(__name__)
 
 # Create blueprint
 auth = Blueprint('auth', __name__, url_prefix='/auth')
 
-# Initialize OAuth
-oauth = OAuth()
-google = oauth.register(
-    name='google',
-    client_id=os.environ.get('GOOGLE_CLIENT_ID'),
-    client_secret=os.environ.get('GOOGLE_CLIENT_SECRET'),
-    access_token_url='https://accounts.google.com/o/oauth2/token',
-    access_token_params=None,
-    authorize_url='https://accounts.google.com/o/oauth2/auth',
-    authorize_params=None,
-    api_base_url='https://www.googleapis.com/oauth2/v1/',
-    client_kwargs={'scope': 'openid email profile'},
-)
+# Login fields cached per email so authentication skips the ORM
+CachedUser = namedtuple('CachedUser', ['id', 'password_hash', 'google_id'])
+USER_CACHE_TTL = 300  # 5 minutes
+
+# Every login attempt takes at least this long, plus jitter
+LOGIN_MIN_DURATION = config.get('LOGIN_MIN_DURATION_MS', 300) / 1000
+LOGIN_JITTER = 0.05
+
+def _google():
+    """
+    Get the app's Google OAuth client, importing authlib on first use.
+    
+    authlib pulls in requests and cryptography, so workers that never serve an
+    OAuth request don't pay for them. The client is kept in app.extensions so
+    each app gets its own.
+    """
+    app = current_app._get_current_object()
+    google = app.extensions.get('google_oauth')
+    if google is not None:
+        return google
+    
+    from authlib.integrations.flask_client import OAuth
+    
+    oauth = OAuth(app)
+    google = app.extensions['google_oauth'] = oauth.register(
+        name='google',
+        client_id=os.environ.get('GOOGLE_CLIENT_ID'),
+        client_secret=os.environ.get('GOOGLE_CLIENT_SECRET'),
+        access_token_url='https://accounts.google.com/o/oauth2/token',
+        access_token_params=None,
+        authorize_url='https://accounts.google.com/o/oauth2/auth',
+        authorize_params=None,
+        api_base_url='https://www.googleapis.com/oauth2/v1/',
+        client_kwargs={'scope': 'openid email profile'},
+    )
+    return google
+
+def json_response(payload, status=200):
+    """Build a JSON response serialized with orjson."""
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
+
+def success_response(redirect_url):
+    """Build the JSON response sent after a successful login or signup."""
+    return json_response({'status': 'success', 'redirect': redirect_url})
+
+def get_request_data():
+    """Get submitted fields from either a JSON body or a form post."""
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else request.form
+
+def _user_cache_key(email):
+    """Build the Redis key for a cached user lookup."""
+    return f"u:{hashlib.sha1(email.encode()).hexdigest()}"
+
+def get_user_by_email(email):
+    """
+    Look up the login fields for an email address.
+    
+    Checks Redis first and falls back to the database, caching the result.
+    
+    Returns:
+        CachedUser or None if no user has this email
+    """
+    key = _user_cache_key(email)
+    
+    try:
+        cached = redis_client.get(key)
+        if cached:
+            return CachedUser(*json.loads(cached))
+    except redis.RedisError as e:
+        logger.warning(f"User cache read failed: {e}")
+    
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        return None
+    
+    record = CachedUser(user.id, user.password_hash, user.google_id)
+    try:
+        redis_client.setex(key, USER_CACHE_TTL, json.dumps(record))
+    except redis.RedisError as e:
+        logger.warning(f"User cache write failed: {e}")
+    
+    return record
+
+def invalidate_user_cache(email):
+    """Drop the cached lookup for an email after the user row changes."""
+    try:
+        redis_client.delete(_user_cache_key(email))
+    except redis.RedisError as e:
+        logger.warning(f"User cache invalidation failed: {e}")
+
+def authenticate(email, password):
+    """
+    Check login credentials in roughly constant time.
+    
+    Unknown emails and password-less (Google) accounts are verified against a
+    dummy hash, and every call is padded to LOGIN_MIN_DURATION with jitter, so
+    response time doesn't reveal whether an account exists.
+    
+    Returns:
+        Tuple containing (user_or_none, elapsed_seconds)
+    """
+    start = time.perf_counter()
+    user = None
+    
+    record = get_user_by_email(email)
+    if record and record.password_hash:
+        # Check the cached hash, then load the row to log in
+        if verify_password_hash(record.password_hash, password):
+            user = db.session.get(User, record.id)
+            if not user:
+                invalidate_user_cache(email)
+            elif password_needs_rehash(user.password_hash):
+                # Upgrade legacy or outdated hashes now that we know the password
+                user.set_password(password)
+                db.session.commit()
+                invalidate_user_cache(email)
+    else:
+        verify_password_hash(dummy_password_hash(), password)
+    
+    elapsed = time.perf_counter() - start
+    time.sleep(max(0, LOGIN_MIN_DURATION - elapsed) + random.uniform(0, LOGIN_JITTER))
+    return user, elapsed
 
 @auth.route('/login')
 def login():
@@ -51,41 +170,35 @@ def login():
 def login_post():
     """Handle login form submission."""
     # Get form data
-    if request.is_json:
-        data = request.get_json()
-        email = data.get('email')
-        password = data.get('password')
-        remember = data.get('remember', False)
-    else:
-        email = request.form.get('email')
-        password = request.form.get('password')
-        remember = request.form.get('remember') == 'on'
+    data = get_request_data()
+    email = data.get('email')
+    password = data.get('password')
+    remember = data.get('remember') in (True, 'on')
     
     # Input validation
     if not email or not password:
-        return jsonify({'error': 'Please provide both email and password'}), 400
+        return json_response({'error': 'Please provide both email and password'}, 400)
     
     # Check if account is locked
     is_allowed, lockout_time = check_login_attempts(email)
     if not is_allowed:
-        return jsonify({
+        return json_response({
             'error': f'Too many login attempts. Try again in {lockout_time} seconds.'
-        }), 429
+        }, 429)
     
-    # Find user
-    user = User.query.filter_by(email=email).first()
+    # Check credentials
+    user, _ = authenticate(email, password)
     
-    # Check password
-    if not user or not user.check_password(password):
+    if not user:
         # Record failed login
         is_locked, lockout_time = record_failed_login(email)
         
         if is_locked:
-            return jsonify({
+            return json_response({
                 'error': f'Account locked due to too many failed attempts. Try again in {lockout_time} seconds.'
-            }), 429
+            }, 429)
         
-        return jsonify({'error': 'Invalid email or password. Please try again.'}), 401
+        return json_response({'error': 'Invalid email or password. Please try again.'}, 401)
     
     # Record successful login
     record_successful_login(email)
@@ -96,10 +209,7 @@ def login_post():
     # Get redirect URL
     next_url = session.pop('next_url', None) or url_for('chat.dashboard')
     
-    return jsonify({
-        'status': 'success',
-        'redirect': next_url
-    })
+    return success_response(next_url)
 
 @auth.route('/signup')
 def signup():
@@ -116,29 +226,23 @@ def signup():
 def register():
     """Handle registration form submission."""
     # Get registration data
-    if request.is_json:
-        data = request.get_json()
-        name = data.get('name')
-        email = data.get('email')
-        password = data.get('password')
-    else:
-        name = request.form.get('name')
-        email = request.form.get('email')
-        password = request.form.get('password')
+    data = get_request_data()
+    name = data.get('name')
+    email = data.get('email')
+    password = data.get('password')
     
     # Input validation
     if not name or not email or not password:
-        return jsonify({'error': 'Please provide all required fields'}), 400
+        return json_response({'error': 'Please provide all required fields'}, 400)
     
     # Check if email already exists
-    user = User.query.filter_by(email=email).first()
-    if user:
-        return jsonify({'error': 'Email address already in use'}), 400
+    if db.session.query(exists().where(User.email == email)).scalar():
+        return json_response({'error': 'Email address already in use'}, 400)
     
     # Validate password strength
     is_valid, error_message = validate_password(password)
     if not is_valid:
-        return jsonify({'error': error_message}), 400
+        return json_response({'error': error_message}, 400)
     
     # Create new user
     new_user = User(
@@ -147,26 +251,15 @@ def register():
     )
     new_user.set_password(password)
     
-    # Initialize default skills
-    new_user.skills_dict = {
-        "rapport_building": 0,
-        "needs_discovery": 0,
-        "objection_handling": 0,
-        "closing": 0,
-        "product_knowledge": 0
-    }
-    
     # Save to database
     db.session.add(new_user)
     db.session.commit()
+    invalidate_user_cache(email)
     
     # Log in the new user
     login_user(new_user)
     
-    return jsonify({
-        'status': 'success',
-        'redirect': url_for('chat.dashboard')
-    })
+    return success_response(url_for('chat.dashboard'))
 
 @auth.route('/logout')
 @login_required
@@ -185,28 +278,30 @@ def google_login():
         session['next_url'] = next_url
     
     redirect_uri = url_for('auth.google_callback', _external=True)
-    return google.authorize_redirect(redirect_uri)
+    return _google().authorize_redirect(redirect_uri)
 
 @auth.route('/google/callback')
 def google_callback():
     """Handle Google OAuth callback."""
     try:
+        google = _google()
         token = google.authorize_access_token()
         resp = google.get('userinfo')
         user_info = resp.json()
         
-        # Check if Google ID exists in database
-        user = User.query.filter_by(google_id=user_info['id']).first()
-        
-        # If not, check if email exists
-        if not user:
-            user = User.query.filter_by(email=user_info['email']).first()
+        # Find user by Google ID or email in one query, preferring the Google ID match
+        user = User.query.filter(
+            or_(User.google_id == user_info['id'], User.email == user_info['email'])
+        ).order_by(
+            case((User.google_id == user_info['id'], 0), else_=1)
+        ).first()
         
         # If user exists, update Google ID
         if user:
             if not user.google_id:
                 user.google_id = user_info['id']
                 db.session.commit()
+                invalidate_user_cache(user.email)
         else:
             # Create new user
             user = User(
@@ -214,16 +309,6 @@ def google_callback():
                 email=user_info['email'],
                 google_id=user_info['id']
             )
-            
-            # Initialize default skills
-            user.skills_dict = {
-                "rapport_building": 0,
-                "needs_discovery": 0,
-                "objection_handling": 0,
-                "closing": 0,
-                "product_knowledge": 0
-            }
-            
             db.session.add(user)
             db.session.commit()
         
@@ -5,12 +5,17 @@ This module provides enhanced security for authentication-related functionality
 including secure password handling, rate limiting, and CSRF protection.
 """
 
+import os
 import time
+import hashlib
+import hmac
 import logging
-import secrets
-import re
+import threading
+from collections import OrderedDict
 from typing import Dict, Tuple, Optional, Any
-from functools import wraps
+from functools import wraps, lru_cache
+import redis
+from cachetools import TTLCache
 from flask import request, session, g, redirect, url_for, flash, abort
 
 # Configure logging
@@ -23,12 +28,135 @@ logger = logging.getLogger("AuthSecurity")
 
 # Import config manager
 from config_manager import config
+from redis_client import redis_client
 
-# Rate limiting storage (in-memory, replace with Redis in production)
-_rate_limit_data = {}
+# Security settings resolved once at import
+_PASSWORD_MIN_LENGTH = config.get('PASSWORD_MIN_LENGTH', 8)
+_RATE_LIMIT = config.get('RATE_LIMIT', 10)
+_RATE_LIMIT_WINDOW = config.get('RATE_LIMIT_WINDOW', 60)
+_MAX_LOGIN_ATTEMPTS = config.get('MAX_LOGIN_ATTEMPTS', 5)
+_LOCKOUT_TIME = config.get('LOCKOUT_TIME', 300)  # 5 minutes
 
-# Login attempt tracking storage
-_login_attempts = {}
+@lru_cache(maxsize=1)
+def _key_salt() -> bytes:
+    """Key for hashing tracking keys, derived from the app secret on first use."""
+    return hashlib.blake2b(config.get('FLASK_SECRET_KEY', '').encode(), digest_size=32).digest()
+
+def _hash_key(value: str) -> str:
+    """Hash a tracking key to a fixed 16-byte digest."""
+    return hashlib.blake2b(value.encode(), digest_size=16, key=_key_salt()).hexdigest()
+
+def _ekey(email: str) -> str:
+    """Normalize and hash an email address for use as a tracking key."""
+    return _hash_key(email.strip().lower())
+
+# Local rate limiting storage, used only when Redis is unavailable
+_LOCAL_RATE_LIMIT_SIZE = 10000
+_local_rate_limit_data = OrderedDict()
+
+# Token bucket refilled continuously at limit/window tokens per second.
+# Runs atomically inside Redis and returns {allowed, remaining, retry_after}.
+BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local rate = capacity / window
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = math.ceil((1 - tokens) / rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], window)
+return {allowed, math.floor(tokens), retry_after}
+"""
+
+# Local login attempt tracking, used only when Redis is unavailable;
+# entries expire so it can't grow without bound
+_login_attempts = TTLCache(maxsize=100000, ttl=_LOCKOUT_TIME * 2)
+
+# Count a failed login and start a lockout once the limit is reached.
+# KEYS: fails counter, lockout flag. ARGV: max attempts, counter TTL, lockout time.
+LOCKOUT_LUA = """
+local attempts = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if attempts >= tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[2], '1', 'EX', ARGV[3])
+    redis.call('DEL', KEYS[1])
+    return {1, tonumber(ARGV[3])}
+end
+return {0, 0}
+"""
+
+# Registered once; redis-py calls EVALSHA and reloads the script if flushed
+_bucket_script = redis_client.register_script(BUCKET_LUA)
+_lockout_script = redis_client.register_script(LOCKOUT_LUA)
+
+# Character class bits for password validation
+_DIGIT, _UPPER, _LOWER, _SPECIAL = 1, 2, 4, 8
+_SPECIAL_CHARS = '!@#$%^&*(),.?":{}|<>'
+
+def _build_char_classes() -> bytes:
+    """Build a byte -> character class bitmask lookup table."""
+    table = bytearray(256)
+    for ch in '0123456789':
+        table[ord(ch)] = _DIGIT
+    for ch in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
+        table[ord(ch)] = _UPPER
+    for ch in 'abcdefghijklmnopqrstuvwxyz':
+        table[ord(ch)] = _LOWER
+    for ch in _SPECIAL_CHARS:
+        table[ord(ch)] = _SPECIAL
+    return bytes(table)
+
+_CHAR_CLASS = _build_char_classes()
+
+# Buffered entropy for per-request tokens, refilled from os.urandom in bulk
+_ENTROPY_POOL_SIZE = 4096
+_entropy_pool = b''
+_entropy_pos = 0
+_entropy_lock = threading.Lock()
+
+def _reset_entropy_pool() -> None:
+    """Discard buffered entropy so forked workers never share tokens."""
+    global _entropy_pool, _entropy_pos
+    _entropy_pool = b''
+    _entropy_pos = 0
+
+os.register_at_fork(after_in_child=_reset_entropy_pool)
+
+def pooled_token_hex(nbytes: int = 16) -> str:
+    """
+    Generate a random hex token from the process entropy buffer.
+    
+    Reads 4 KB from the OS at a time instead of making one syscall per token.
+    
+    Args:
+        nbytes: Number of random bytes in the token
+        
+    Returns:
+        Hex encoded token
+    """
+    global _entropy_pool, _entropy_pos
+    
+    with _entropy_lock:
+        if _entropy_pos + nbytes > len(_entropy_pool):
+            _entropy_pool = os.urandom(_ENTROPY_POOL_SIZE)
+            _entropy_pos = 0
+        start = _entropy_pos
+        _entropy_pos += nbytes
+    
+    return _entropy_pool[start:start + nbytes].hex()
 
 def validate_password(password: str) -> Tuple[bool, str]:
     """
@@ -40,25 +168,30 @@ def validate_password(password: str) -> Tuple[bool, str]:
     Returns:
         Tuple containing (is_valid, error_message)
     """
-    min_length = config.get('PASSWORD_MIN_LENGTH', 8)
+    min_length = _PASSWORD_MIN_LENGTH
     
     if len(password) < min_length:
         return False, f"Password must be at least {min_length} characters long"
     
+    # Classify every character in a single pass
+    flags = 0
+    for byte in password.encode():
+        flags |= _CHAR_CLASS[byte]
+    
     # Check for at least one digit
-    if not re.search(r'\d', password):
+    if not flags & _DIGIT:
         return False, "Password must contain at least one digit"
     
     # Check for at least one uppercase letter
-    if not re.search(r'[A-Z]', password):
+    if not flags & _UPPER:
         return False, "Password must contain at least one uppercase letter"
     
     # Check for at least one lowercase letter
-    if not re.search(r'[a-z]', password):
+    if not flags & _LOWER:
         return False, "Password must contain at least one lowercase letter"
     
     # Check for at least one special character
-    if not re.search(r'[!@#$%^&*(),.?":{}|<>]', password):
+    if not flags & _SPECIAL:
         return False, "Password must contain at least one special character"
     
     return True, ""
@@ -75,34 +208,53 @@ def check_rate_limit(key: str, limit: int = None, window: int = None) -> Tuple[b
     Returns:
         Tuple containing (is_allowed, remaining_attempts, retry_after)
     """
-    global _rate_limit_data
-    
     if limit is None:
-        limit = config.get('RATE_LIMIT', 10)
+        limit = _RATE_LIMIT
         
     if window is None:
-        window = config.get('RATE_LIMIT_WINDOW', 60)
+        window = _RATE_LIMIT_WINDOW
     
     current_time = time.time()
+    key = _hash_key(key)
     
-    # Initialize or clean up old timestamps for this key
-    if key not in _rate_limit_data:
-        _rate_limit_data[key] = []
+    try:
+        allowed, remaining, retry_after = _bucket_script(
+            keys=[f"ratelimit:{key}"],
+            args=[limit, window, current_time]
+        )
+    except redis.RedisError as e:
+        logger.error(f"Redis unavailable for rate limiting, using local fallback: {e}")
+        return _check_local_rate_limit(key, limit, window, current_time)
+    
+    return bool(allowed), remaining, retry_after
+
+def _check_local_rate_limit(key: str, limit: int, window: int, current_time: float) -> Tuple[bool, int, int]:
+    """
+    Per-process sliding window rate limit used when Redis is unavailable.
     
+    Keys are kept in LRU order so the fallback can't grow without bound.
+    
+    Returns:
+        Tuple containing (is_allowed, remaining_attempts, retry_after)
+    """
     # Remove timestamps older than the window
-    _rate_limit_data[key] = [t for t in _rate_limit_data[key] 
-                            if current_time - t < window]
+    timestamps = [t for t in _local_rate_limit_data.get(key, [])
+                  if current_time - t < window]
+    _local_rate_limit_data[key] = timestamps
+    _local_rate_limit_data.move_to_end(key)
+    
+    # Evict least recently used keys
+    while len(_local_rate_limit_data) > _LOCAL_RATE_LIMIT_SIZE:
+        _local_rate_limit_data.popitem(last=False)
     
     # Check if rate limit is exceeded
-    if len(_rate_limit_data[key]) >= limit:
-        oldest_timestamp = _rate_limit_data[key][0]
-        retry_after = int(window - (current_time - oldest_timestamp))
+    if len(timestamps) >= limit:
+        retry_after = int(window - (current_time - timestamps[0]))
         return False, 0, retry_after
     
     # Add timestamp and return allowed
-    _rate_limit_data[key].append(current_time)
-    remaining = limit - len(_rate_limit_data[key])
-    return True, remaining, 0
+    timestamps.append(current_time)
+    return True, limit - len(timestamps), 0
 
 def check_login_attempts(username: str) -> Tuple[bool, int]:
     """
@@ -114,21 +266,83 @@ def check_login_attempts(username: str) -> Tuple[bool, int]:
     Returns:
         Tuple containing (is_allowed, lockout_time_remaining)
     """
-    global _login_attempts
+    key = _ekey(username)
     
-    max_attempts = config.get('MAX_LOGIN_ATTEMPTS', 5)
-    lockout_time = config.get('LOCKOUT_TIME', 300)  # 5 minutes
-    current_time = time.time()
+    try:
+        # TTL is -2 when no lockout key exists
+        time_remaining = redis_client.ttl(f"lock:{key}")
+    except redis.RedisError as e:
+        logger.error(f"Redis unavailable for login tracking, using local fallback: {e}")
+        return _check_local_login_attempts(key)
     
-    # Initialize login attempts if needed
-    if username not in _login_attempts:
-        _login_attempts[username] = {
+    if time_remaining > 0:
+        return False, time_remaining
+    
+    return True, 0
+
+def record_failed_login(username: str) -> Tuple[bool, int]:
+    """
+    Record a failed login attempt and determine if account should be locked.
+    
+    Args:
+        username: Username or email that failed to log in
+        
+    Returns:
+        Tuple containing (is_locked_out, lockout_time)
+    """
+    key = _ekey(username)
+    
+    try:
+        is_locked, lockout_time = _lockout_script(
+            keys=[f"fails:{key}", f"lock:{key}"],
+            args=[_MAX_LOGIN_ATTEMPTS, _LOCKOUT_TIME * 2, _LOCKOUT_TIME]
+        )
+    except redis.RedisError as e:
+        logger.error(f"Redis unavailable for login tracking, using local fallback: {e}")
+        is_locked, lockout_time = _record_local_failed_login(key)
+    
+    if is_locked:
+        logger.warning(f"Account locked due to too many failed attempts: {username}")
+        return True, lockout_time
+    
+    return False, 0
+
+def record_successful_login(username: str) -> None:
+    """
+    Record a successful login and reset failed attempt counter.
+    
+    Args:
+        username: Username or email that successfully logged in
+    """
+    key = _ekey(username)
+    
+    try:
+        redis_client.delete(f"fails:{key}")
+    except redis.RedisError as e:
+        logger.error(f"Redis unavailable for login tracking, using local fallback: {e}")
+    
+    if key in _login_attempts:
+        _login_attempts[key] = {
             'attempts': 0,
-            'last_attempt': 0,
+            'last_attempt': time.time(),
             'lockout_until': 0
         }
+
+def _check_local_login_attempts(key: str) -> Tuple[bool, int]:
+    """
+    Per-process lockout check used when Redis is unavailable.
+    
+    Args:
+        key: Hashed email from _ekey
+        
+    Returns:
+        Tuple containing (is_allowed, lockout_time_remaining)
+    """
+    current_time = time.time()
+    user_data = _login_attempts.get(key)
     
-    user_data = _login_attempts[username]
+    if user_data is None:
+        return True, 0
     
     # Check if user is in lockout period
     if user_data['lockout_until'] > current_time:
@@ -141,65 +355,47 @@ def check_login_attempts(username: str) -> Tuple[bool, int]:
     
     return True, 0
 
-def record_failed_login(username: str) -> Tuple[bool, int]:
+def _record_local_failed_login(key: str) -> Tuple[bool, int]:
     """
-    Record a failed login attempt and determine if account should be locked.
+    Per-process failed login tracking used when Redis is unavailable.
     
     Args:
-        username: Username or email that failed to log in
+        key: Hashed email from _ekey
         
     Returns:
         Tuple containing (is_locked_out, lockout_time)
     """
-    global _login_attempts
-    
-    max_attempts = config.get('MAX_LOGIN_ATTEMPTS', 5)
-    lockout_time = config.get('LOCKOUT_TIME', 300)  # 5 minutes
     current_time = time.time()
     
     # Initialize login attempts if needed
-    if username not in _login_attempts:
-        _login_attempts[username] = {
-            'attempts': 0,
-            'last_attempt': 0,
-            'lockout_until': 0
-        }
-    
-    user_data = _login_attempts[username]
+    user_data = _login_attempts.get(key) or {
+        'attempts': 0,
+        'last_attempt': 0,
+        'lockout_until': 0
+    }
     
     # Increment attempt count
     user_data['attempts'] += 1
     user_data['last_attempt'] = current_time
     
+    # (Re-)insert to restart the entry's TTL from this attempt
+    _login_attempts[key] = user_data
+    
     # Check if should be locked out
-    if user_data['attempts'] >= max_attempts:
-        user_data['lockout_until'] = current_time + lockout_time
-        logger.warning(f"Account locked due to too many failed attempts: {username}")
-        return True, lockout_time
+    if user_data['attempts'] >= _MAX_LOGIN_ATTEMPTS:
+        user_data['lockout_until'] = current_time + _LOCKOUT_TIME
+        return True, _LOCKOUT_TIME
     
     return False, 0
 
-def record_successful_login(username: str) -> None:
-    """
-    Record a successful login and reset failed attempt counter.
-    
-    Args:
-        username: Username or email that successfully logged in
-    """
-    global _login_attempts
-    
-    if username in _login_attempts:
-        _login_attempts[username] = {
-            'attempts': 0,
-            'last_attempt': time.time(),
-            'lockout_until': 0
-        }
+def _mint_csrf_token():
+    """Create a new CSRF token and store it in the session."""
+    token = session['_csrf_token'] = pooled_token_hex()
+    return token
 
 def generate_csrf_token():
-    """Generate a CSRF token and store it in the session."""
-    if '_csrf_token' not in session:
-        session['_csrf_token'] = secrets.token_hex(16)
-    return session['_csrf_token']
+    """Get the session's CSRF token, creating it on first use."""
+    return session.get('_csrf_token') or _mint_csrf_token()
 
 # CSRF protection decorator
 def csrf_required(f):
@@ -211,16 +407,17 @@ def csrf_required(f):
             generate_csrf_token()
             return f(*args, **kwargs)
         
-        # For other methods like POST, validate token
-        token = request.form.get('csrf_token')
-        
-        # For JSON requests, check header
-        if request.is_json and not token:
+        # For other methods like POST, validate token without parsing JSON bodies
+        is_json = 'application/json' in request.headers.get('Content-Type', '')
+        if is_json:
             token = request.headers.get('X-CSRF-Token')
+        else:
+            token = request.form.get('csrf_token')
         
-        if not token or token != session.get('_csrf_token'):
+        expected = session.get('_csrf_token', '')
+        if not token or not hmac.compare_digest(token.encode(), expected.encode()):
             logger.warning(f"CSRF validation failed for {request.path}")
-            if request.is_json:
+            if is_json:
                 abort(403)
             flash('For security reasons, your form submission could not be processed. Please try again.', 'error')
             return redirect(url_for('index'))
@@ -249,10 +446,9 @@ def rate_limit(limit=None, window=None):
             if not allowed:
                 logger.warning(f"Rate limit exceeded for {key}")
                 
-                # Set headers for rate limiting info
-                response = redirect(url_for('errors.too_many_requests'))
-                response.headers['Retry-After'] = str(retry_after)
-                return response
+                # The 429 handler reads the wait for this route's window from g
+                g.retry_after = retry_after
+                abort(429)
             
             return f(*args, **kwargs)
         return decorated_function
@@ -4,24 +4,137 @@ Chat routes for the Sales Training AI application.
 This module provides routes for the chat interface, conversation management, 
 and interaction with the Claude AI service.
 """
-from flask import Blueprint, render_template, request, jsonify, g, redirect, url_for
+from flask import Blueprint, Response, render_template, request, jsonify, g, redirect, url_for, stream_with_context
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
 from flask_login import login_required, current_user
-from models import db, User, Conversation, Message
-from claude_service import claude_service
+from models import db, User, UserSkill, Conversation, Message, DEFAULT_SKILLS
+from claude_service import get_claude_service
+from redis_client import redis_client
+from tasks import enqueue, enqueue_summary, update_user_stats_task
+from collections import namedtuple
 from datetime import datetime
 import json
+import logging
+import re
+import textwrap
+import redis
+
+logger = logging.getLogger(__name__)
 
 # Create blueprint
 chat = Blueprint('chat', __name__, url_prefix='/chat')
 
+# Conversation context sent to Claude: at most HISTORY_WINDOW raw messages,
+# with anything older than RECENT_MESSAGES folded into a rolling summary
+HISTORY_WINDOW = 20
+RECENT_MESSAGES = 10
+SUMMARY_BATCH = 5
+HISTORY_TOKEN_BUDGET = 8000
+HISTORY_CACHE_TTL = 24 * 60 * 60
+
+# Conversation lists shown on the dashboard and in the chat sidebar
+ConversationSummary = namedtuple('ConversationSummary', ['id', 'title', 'updated_at'])
+CONVERSATION_LIST_TTL = 300  # 5 minutes
+
+# Sales context extraction patterns
+EXP_RE = re.compile(r'\b(\d{1,2})\s*(year|yr|month|mo)s?\b', re.I)
+EXPERIENCE_LEVELS = {
+    'beginner': 'beginner', 'new': 'beginner', 'novice': 'beginner', 'starting': 'beginner',
+    'intermediate': 'intermediate', 'some experience': 'intermediate', 'a few years': 'intermediate',
+    'experienced': 'experienced', 'expert': 'experienced', 'veteran': 'experienced',
+    'seasoned': 'experienced', 'senior': 'experienced',
+}
+LEVEL_RE = re.compile(r'\b(' + '|'.join(map(re.escape, EXPERIENCE_LEVELS)) + r')\b', re.I)
+# Selling indicator followed by everything up to the end of the clause
+PRODUCT_RE = re.compile(
+    r"\b(?:i'm selling|we're selling|i sell|we sell|product is|service is"
+    r"|selling|offer|promote|market|sell)\w*\s+([^.!?,\n]+)"
+)
+MARKET_RE = re.compile(
+    r'\b(?:(?P<B2B>b2b|business to business|businesses|companies|corporations|organizations)'
+    r'|(?P<B2C>b2c|business to consumer|consumers|individuals|people|retail)'
+    r'|(?P<mixed>both|mix|hybrid))\b',
+    re.I
+)
+
+# Feedback parsing patterns
+SECTION_RE = re.compile(r'### (Strengths|Areas for Improvement)(.*?)(?=###|\Z)', re.S)
+BULLET_RE = re.compile(r'^\s*-\s*', re.M)
+SKILL_MAP = {
+    'rapport': 'rapport_building',
+    'discovery': 'needs_discovery', 'question': 'needs_discovery',
+    'listen': 'needs_discovery', 'understanding': 'needs_discovery',
+    'objection': 'objection_handling', 'concern': 'objection_handling',
+    'handle': 'objection_handling', 'address': 'objection_handling',
+    'close': 'closing', 'closing': 'closing', 'commitment': 'closing', 'decision': 'closing',
+    'product': 'product_knowledge', 'knowledge': 'product_knowledge',
+    'feature': 'product_knowledge', 'benefit': 'product_knowledge',
+}
+SKILL_RE = re.compile('|'.join(sorted(map(re.escape, SKILL_MAP), key=len, reverse=True)))
+
+def conversation_list_key(user_id):
+    """Redis key for a user's cached conversation list."""
+    return f"chat:convs:{user_id}"
+
+def get_user_conversations(user_id):
+    """
+    Get a user's conversations, most recently updated first.
+    
+    Only the columns the dashboard and sidebar show are loaded, and the list
+    is cached in Redis until the user's conversations change.
+    
+    Args:
+        user_id: ID of the user
+        
+    Returns:
+        List of ConversationSummary tuples
+    """
+    key = conversation_list_key(user_id)
+    try:
+        cached = redis_client.get(key)
+        if cached:
+            return [
+                ConversationSummary(conv_id, title, datetime.fromisoformat(updated_at))
+                for conv_id, title, updated_at in json.loads(cached)
+            ]
+    except redis.RedisError as e:
+        logger.warning(f"Conversation list cache read failed: {e}")
+    
+    rows = db.session.query(
+        Conversation.id, Conversation.title, Conversation.updated_at
+    ).filter_by(user_id=user_id).order_by(Conversation.updated_at.desc()).all()
+    conversations = [ConversationSummary(*row) for row in rows]
+    
+    try:
+        redis_client.setex(key, CONVERSATION_LIST_TTL, json.dumps([
+            [conv.id, conv.title, conv.updated_at.isoformat()] for conv in conversations
+        ]))
+    except redis.RedisError as e:
+        logger.warning(f"Conversation list cache write failed: {e}")
+    
+    return conversations
+
+def invalidate_user_conversations(user_id):
+    """Drop a user's cached conversation list after it changes."""
+    try:
+        redis_client.delete(conversation_list_key(user_id))
+    except redis.RedisError as e:
+        logger.warning(f"Conversation list cache delete failed: {e}")
+
 @chat.route('/dashboard')
 @login_required
 def dashboard():
     """User dashboard page."""
-    # Get user's conversations
-    conversations = Conversation.query.filter_by(user_id=current_user.id).order_by(Conversation.updated_at.desc()).limit(5).all()
+    # Get user's most recent conversations
+    conversations = get_user_conversations(current_user.id)[:5]
+    
+    # Skill ratings as a plain dict, read with a single column query
+    skills = dict(
+        db.session.query(UserSkill.skill, UserSkill.value).filter_by(user_id=current_user.id).all()
+    )
     
-    return render_template('dashboard.html', user=current_user, conversations=conversations)
+    return render_template('dashboard.html', user=current_user, skills=skills, conversations=conversations)
 
 @chat.route('/')
 @login_required
@@ -31,23 +144,26 @@ def chat_page():
     conversation_id = request.args.get('conversation')
     
     if conversation_id:
-        # Load existing conversation
-        conversation = Conversation.query.filter_by(id=conversation_id, user_id=current_user.id).first_or_404()
+        # Load existing conversation along with its transcript
+        conversation = Conversation.query.options(
+            selectinload(Conversation.messages)
+        ).filter_by(id=conversation_id, user_id=current_user.id).first_or_404()
     else:
         # Create new conversation
         conversation = Conversation(user_id=current_user.id)
         db.session.add(conversation)
         db.session.commit()
+        invalidate_user_conversations(current_user.id)
     
     # Get all user conversations for sidebar
-    conversations = Conversation.query.filter_by(user_id=current_user.id).order_by(Conversation.updated_at.desc()).all()
+    conversations = get_user_conversations(current_user.id)
     
     return render_template('chat.html', conversation=conversation, conversations=conversations)
 
 @chat.route('/<int:conversation_id>/message', methods=['POST'])
 @login_required
 def send_message(conversation_id):
-    """Send a message to the AI."""
+    """Send a message to the AI and stream the reply as Server-Sent Events."""
     # Find conversation
     conversation = Conversation.query.filter_by(id=conversation_id, user_id=current_user.id).first_or_404()
     
@@ -58,61 +174,203 @@ def send_message(conversation_id):
     if not message_content:
         return jsonify({'error': 'Message content is required'}), 400
     
-    # Create user message
+    # Last 20 messages for context, already formatted for Claude
+    history = load_history(conversation)
+    
+    # The title check only needs to know whether this is the first exchange,
+    # so the capped length stands in for a full count
+    message_count = len(history)
+    
+    # Create user message; it is written together with the reply
     user_message = Message(
         conversation_id=conversation.id,
         role='user',
         content=message_content
     )
-    db.session.add(user_message)
     
     # Generate AI response
     if not conversation.persona:
         # First message needs to collect sales context and generate persona
-        ai_response = handle_first_message(conversation, message_content)
+        chunks = iter([handle_first_message(conversation, message_content)])
     else:
-        # Normal message
-        ai_response = generate_ai_response(conversation, message_content)
+        # Normal message, streamed from Claude as it is generated
+        chunks = generate_ai_response_stream(conversation, message_content, history)
+        
+        # Everything the reply needs is loaded, so end the read transaction
+        # and hand the connection back instead of holding it for the stream
+        db.session.commit()
     
-    # Create AI message
-    ai_message = Message(
-        conversation_id=conversation.id,
-        role='assistant',
-        content=ai_response
+    def generate():
+        parts = []
+        failed = False
+        ai_message = None
+        try:
+            for text in chunks:
+                parts.append(text)
+                yield sse_event({'delta': text})
+        except Exception as e:
+            logger.error(f"Error streaming AI response: {e}")
+            failed = True
+            yield sse_event({'status': 'error', 'error': 'Failed to generate response'})
+        finally:
+            # Runs on completion, on error and when the client disconnects;
+            # a reply cut off by an error is dropped rather than saved half-written
+            ai_response = '' if failed else ''.join(parts)
+            ai_message = save_exchange(conversation, user_message, ai_response, message_count)
+        
+        if ai_message is not None:
+            yield sse_event({
+                'status': 'success',
+                'message': {
+                    'role': 'assistant',
+                    'content': ai_message.content,
+                    'timestamp': ai_message.timestamp.isoformat()
+                }
+            })
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
     )
-    db.session.add(ai_message)
-    
-    # Update conversation
-    conversation.updated_at = datetime.utcnow()
-    
-    # If this is the first real exchange, update the title
-    message_count = Message.query.filter_by(conversation_id=conversation.id).count()
-    if message_count <= 2 and not conversation.title or conversation.title == "New Conversation":
-        # Create a title from the first few words
-        words = message_content.split()
-        if len(words) > 2:
-            # Use first few words as title
-            new_title = " ".join(words[:5])
-            if len(new_title) > 30:
-                new_title = new_title[:27] + "..."
-            conversation.title = new_title
-    
-    # Save changes
-    db.session.commit()
+
+def sse_event(payload):
+    """Format a payload as a single Server-Sent Events message."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+def save_exchange(conversation, user_message, ai_response, previous_count):
+    """
+    Persist a streamed exchange in a single transaction.
     
-    return jsonify({
-        'status': 'success',
-        'message': {
-            'role': 'assistant',
-            'content': ai_response,
-            'timestamp': ai_message.timestamp.isoformat()
-        }
-    })
+    Both messages and the conversation update are written in one flush
+    after the reply has finished; an empty reply (the stream failed) stores
+    only the user message.
+    
+    Args:
+        conversation: The conversation being replied to
+        user_message: The unsaved user Message
+        ai_response: The assembled assistant reply
+        previous_count: Number of messages in the conversation before this exchange
+        
+    Returns:
+        The saved assistant Message, or None if there was nothing to save
+    """
+    message_content = user_message.content
+    ai_message = None
+    try:
+        new_messages = [user_message]
+        if ai_response:
+            ai_message = Message(
+                conversation_id=conversation.id,
+                role='assistant',
+                content=ai_response
+            )
+            new_messages.append(ai_message)
+        db.session.add_all(new_messages)
+        
+        # Update conversation; the database fills in the time
+        conversation.updated_at = func.current_timestamp()
+        
+        # If this is the first real exchange, update the title
+        is_first_exchange = previous_count == 0
+        if is_first_exchange and (not conversation.title or conversation.title == "New Conversation"):
+            # Create a title from the first few words
+            words = message_content.split()
+            if len(words) > 2:
+                # Use first few words as title, cut at a word boundary
+                first_words = " ".join(words[:5])
+                new_title = textwrap.shorten(first_words, width=30, placeholder="...")
+                if new_title == "...":
+                    # A single word longer than the title
+                    new_title = first_words[:27] + "..."
+                conversation.title = new_title
+        
+        # Save changes
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"Error saving streamed exchange: {e}")
+        db.session.rollback()
+        return None
+    
+    # The sidebar order and title may have changed
+    invalidate_user_conversations(conversation.user_id)
+    
+    # Extend the cached context window with this exchange
+    exchange = [{'role': 'user', 'content': message_content}]
+    if ai_message is not None:
+        exchange.append({'role': 'assistant', 'content': ai_response})
+    append_history(conversation.id, exchange)
+    
+    return ai_message
+
+def history_key(conversation_id):
+    """Redis key for a conversation's cached context window."""
+    return f"conv:{conversation_id}:ctx"
+
+def load_history(conversation):
+    """
+    Get the last HISTORY_WINDOW messages of a conversation, oldest first.
+    
+    The window is kept in Redis as pre-formatted role/content dicts so turns
+    don't re-query and re-format it; on a miss it is rebuilt from the database.
+    
+    Returns:
+        List of message dictionaries with 'role' and 'content'
+    """
+    key = history_key(conversation.id)
+    try:
+        cached = redis_client.lrange(key, 0, -1)
+        if cached:
+            return [json.loads(item) for item in cached]
+    except redis.RedisError as e:
+        logger.warning(f"Context cache unavailable: {e}")
+    
+    # Newest first from the index, then flipped
+    messages = Message.query.filter_by(conversation_id=conversation.id).order_by(
+        Message.timestamp.desc()
+    ).limit(HISTORY_WINDOW).all()[::-1]
+    history = [{'role': msg.role, 'content': msg.content} for msg in messages]
+    
+    if history:
+        try:
+            pipe = redis_client.pipeline()
+            pipe.delete(key)
+            pipe.rpush(key, *[json.dumps(msg) for msg in history])
+            pipe.expire(key, HISTORY_CACHE_TTL)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Could not cache context window: {e}")
+    
+    return history
+
+def append_history(conversation_id, messages):
+    """
+    Append messages to a cached context window, trimming it to HISTORY_WINDOW.
+    
+    Only an existing window is extended; a missing one is rebuilt in full
+    from the database on the next load.
+    """
+    key = history_key(conversation_id)
+    try:
+        pipe = redis_client.pipeline()
+        # RPUSHX takes a single value in redis-py 4.5, so push them one by one
+        for msg in messages:
+            pipe.rpushx(key, json.dumps(msg))
+        pipe.ltrim(key, -HISTORY_WINDOW, -1)
+        pipe.expire(key, HISTORY_CACHE_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not update context window: {e}")
 
 @chat.route('/<int:conversation_id>/feedback')
 @login_required
 def get_feedback(conversation_id):
-    """Get AI feedback on the conversation."""
+    """
+    Get AI feedback on the conversation.
+    
+    The Claude call goes through the shared pooled client; under gevent
+    workers the socket read yields to other requests while it waits.
+    """
     # Find conversation
     conversation = Conversation.query.filter_by(id=conversation_id, user_id=current_user.id).first_or_404()
     
@@ -128,14 +386,10 @@ def get_feedback(conversation_id):
     ]
     
     # Generate feedback
-    feedback = claude_service.generate_feedback(formatted_messages)
-    
-    # Update user's stats based on feedback
-    update_user_stats(current_user, feedback)
+    feedback = get_claude_service().generate_feedback(formatted_messages)
     
-    # Increment completed roleplays
-    current_user.completed_roleplays += 1
-    db.session.commit()
+    # Update user's stats in the background so the feedback returns now
+    enqueue(update_user_stats_task, current_user.id, feedback)
     
     return jsonify({
         'status': 'success',
@@ -146,10 +400,19 @@ def get_feedback(conversation_id):
 @login_required
 def delete_conversation(conversation_id):
     """Delete a conversation."""
-    conversation = Conversation.query.filter_by(id=conversation_id, user_id=current_user.id).first_or_404()
+    # The delete cascades to the messages, so load them in one query
+    conversation = Conversation.query.options(
+        selectinload(Conversation.messages)
+    ).filter_by(id=conversation_id, user_id=current_user.id).first_or_404()
     
     db.session.delete(conversation)
     db.session.commit()
+    invalidate_user_conversations(current_user.id)
+    
+    try:
+        redis_client.delete(history_key(conversation_id))
+    except redis.RedisError as e:
+        logger.warning(f"Could not clear context window: {e}")
     
     return jsonify({'status': 'success'})
 
@@ -182,7 +445,7 @@ def handle_first_message(conversation, message_content):
     }
     
     # Generate persona
-    persona = claude_service.generate_customer_persona(sales_info)
+    persona = get_claude_service().generate_customer_persona(sales_info)
     conversation.persona = persona
     
     # Start the roleplay
@@ -190,17 +453,52 @@ def handle_first_message(conversation, message_content):
     
     return greeting
 
-def generate_ai_response(conversation, message_content):
+def recent_context(conversation, history):
     """
-    Generate an AI response using the Claude service.
+    Select the messages to send verbatim, queueing summaries of older ones.
+    
+    Everything after the summarized prefix is sent as-is. Once that grows by
+    SUMMARY_BATCH beyond the RECENT_MESSAGES window, or its estimated size
+    nears HISTORY_TOKEN_BUDGET, the older part is queued for summarizing; at
+    most one summary per conversation is queued at a time.
+    
+    Args:
+        conversation: The conversation being replied to
+        history: The most recent message dictionaries, oldest first
+        
+    Returns:
+        The messages not yet covered by the conversation summary
     """
-    # Get conversation history
-    messages = Message.query.filter_by(conversation_id=conversation.id).order_by(Message.timestamp).all()
+    total = len(history)
+    if total == HISTORY_WINDOW:
+        # The window is full, so count the whole conversation
+        total = Message.query.filter_by(conversation_id=conversation.id).count()
+    
+    pending = total - (conversation.summarized_count or 0)
+    if pending <= 0:
+        return []
+    unsummarized = history[-pending:]
+    
+    # Rough token estimate of four characters per token
+    estimated_tokens = sum(len(msg['content']) for msg in unsummarized) // 4
+    if pending - RECENT_MESSAGES >= SUMMARY_BATCH or (
+        pending > RECENT_MESSAGES and estimated_tokens > 0.8 * HISTORY_TOKEN_BUDGET
+    ):
+        enqueue_summary(conversation.id, total - RECENT_MESSAGES)
+    
+    return unsummarized
+
+def generate_ai_response_stream(conversation, message_content, history):
+    """
+    Stream an AI response using the Claude service.
     
-    # Format messages for Claude (limit to last 20 messages for context)
-    formatted_messages = [
-        {'role': msg.role, 'content': msg.content} for msg in messages[-20:]
-    ]
+    Args:
+        conversation: The conversation being replied to
+        message_content: The new user message
+        history: The most recent message dictionaries, oldest first
+    """
+    # History is already formatted for Claude; copy before adding this turn
+    formatted_messages = list(recent_context(conversation, history))
     
     # Add the new user message
     formatted_messages.append({'role': 'user', 'content': message_content})
@@ -212,158 +510,127 @@ def generate_ai_response(conversation, message_content):
         'sales_experience': conversation.sales_experience
     }
     
-    # Generate response
-    ai_response = claude_service.generate_roleplay_response(
+    # Stream response
+    return get_claude_service().generate_roleplay_response_stream(
         formatted_messages, 
         conversation.persona,
-        sales_info
+        sales_info,
+        conversation.summary
     )
-    
-    return ai_response
 
 def extract_sales_experience(message):
     """Extract sales experience information from message."""
-    # Simple extraction logic - can be improved with more sophisticated NLP
-    message = message.lower()
-    
-    # Check for years/months patterns
-    if any(term in message for term in ['year', 'years', 'yr', 'yrs']):
-        for i in range(1, 31):  # Up to 30 years
-            if f"{i} year" in message or f"{i} years" in message or f"{i} yr" in message or f"{i} yrs" in message:
-                return f"{i} years"
-    
-    if any(term in message for term in ['month', 'months', 'mo', 'mos']):
-        for i in range(1, 36):  # Up to 36 months
-            if f"{i} month" in message or f"{i} months" in message or f"{i} mo" in message or f"{i} mos" in message:
-                return f"{i} months"
-    
-    # Check for experience levels
-    if any(term in message for term in ['beginner', 'new', 'novice', 'starting']):
-        return "beginner"
-    elif any(term in message for term in ['intermediate', 'some experience', 'a few years']):
-        return "intermediate"
-    elif any(term in message for term in ['experienced', 'expert', 'veteran', 'seasoned', 'senior']):
-        return "experienced"
+    # Years take precedence over months, as a "2 years 6 months" answer
+    # is best summarised by the larger unit
+    durations = {unit[0].lower(): int(n) for n, unit in EXP_RE.findall(message)}
+    if 'y' in durations and 1 <= durations['y'] <= 30:  # Up to 30 years
+        return f"{durations['y']} years"
+    if 'm' in durations and 1 <= durations['m'] <= 35:  # Up to 35 months
+        return f"{durations['m']} months"
+    
+    # Check for experience levels, beginner first when several are mentioned
+    levels = {EXPERIENCE_LEVELS[term.lower()] for term in LEVEL_RE.findall(message)}
+    for level in ("beginner", "intermediate", "experienced"):
+        if level in levels:
+            return level
     
     return None
 
 def extract_product_service(message):
     """Extract product or service information from message."""
     # This is a simplified extraction - in real app would use better NLP
-    message = message.lower()
-    
-    # Look for selling indicators
-    selling_indicators = [
-        'selling', 'offer', 'promote', 'market', 'sell', 'product is', 'service is',
-        'i sell', 'we sell', 'i\'m selling', 'we\'re selling'
-    ]
-    
-    for indicator in selling_indicators:
-        if indicator in message:
-            # Extract what comes after the indicator
-            parts = message.split(indicator, 1)
-            if len(parts) > 1 and parts[1].strip():
-                # Extract up to 50 chars or until end of sentence
-                product_text = parts[1].strip()
-                end_markers = ['.', '!', '?', ',', '\n']
-                for marker in end_markers:
-                    if marker in product_text:
-                        product_text = product_text.split(marker, 1)[0]
-                
-                return product_text[:50].strip()
+    match = PRODUCT_RE.search(message.lower())
+    if match:
+        # Up to 50 chars of what follows the indicator, to the end of the clause
+        return match.group(1).strip()[:50].strip() or None
     
     return None
 
 def extract_target_market(message):
     """Extract target market information from message."""
-    message = message.lower()
-    
-    if any(term in message for term in ['b2b', 'business to business', 'businesses', 'companies', 'corporations', 'organizations']):
-        return 'B2B'
-    
-    if any(term in message for term in ['b2c', 'business to consumer', 'consumers', 'individuals', 'people', 'retail']):
-        return 'B2C'
-    
-    if any(term in message for term in ['both', 'mix', 'hybrid', 'b2b and b2c', 'b2c and b2b']):
-        return 'mixed'
+    markets = {m.lastgroup for m in MARKET_RE.finditer(message)}
+    for market in ('B2B', 'B2C', 'mixed'):
+        if market in markets:
+            return market
     
     return None
 
+def split_bullets(body):
+    """Split a feedback section into its bullet items, each capped at 100 characters."""
+    return [item.strip()[:100] for item in BULLET_RE.split(body) if item.strip()]
+
+def count_skill_mentions(items):
+    """Count the feedback items that mention each skill."""
+    counts = {}
+    for item in items:
+        # One lowercase copy per bullet; SKILL_RE matches lowercase terms
+        for skill in set(map(SKILL_MAP.get, SKILL_RE.findall(item.lower()))):
+            counts[skill] = counts.get(skill, 0) + 1
+    return counts
+
+def add_unique(current, items):
+    """Append items not already in current, preserving order."""
+    seen = set(current)
+    for item in items:
+        if item and item not in seen:
+            seen.add(item)
+            current.append(item)
+
 def update_user_stats(user, feedback):
     """Update user stats based on feedback."""
-    try:
-        # Extract strengths and areas for improvement
-        strengths = []
-        weaknesses = []
-        
-        # Simple string-based extraction - could be improved with better parsing
-        if "### Strengths" in feedback:
-            strengths_section = feedback.split("### Strengths")[1].split("###")[0]
-            strength_items = [s.strip() for s in strengths_section.split("-") if s.strip()]
-            strengths = [s[:100] for s in strength_items]
-        
-        if "### Areas for Improvement" in feedback:
-            weaknesses_section = feedback.split("### Areas for Improvement")[1].split("###")[0]
-            weakness_items = [w.strip() for w in weaknesses_section.split("-") if w.strip()]
-            weaknesses = [w[:100] for w in weakness_items]
-        
-        # Update skills based on the feedback
-        skills = user.skills_dict
-        
-        # This is a simple algorithm - could be improved with better NLP
-        # Increase skills mentioned in strengths
-        for strength in strengths:
-            if "rapport" in strength.lower():
-                skills["rapport_building"] = min(100, skills.get("rapport_building", 0) + 5)
+    if not feedback:
+        return
+    
+    # Extract strengths and areas for improvement in one pass
+    sections = {}
+    for label, body in SECTION_RE.findall(feedback):
+        sections.setdefault(label, body)
+    if not sections:
+        return
+    
+    # Work on copies so each column is written back once; users created
+    # before skills had their own table start from the defaults
+    skill_rows = {row.skill: row for row in UserSkill.query.filter_by(user_id=user.id)}
+    skills = dict(DEFAULT_SKILLS)
+    skills.update((name, row.value) for name, row in skill_rows.items())
+    current_strengths = list(user.strengths or [])
+    current_weaknesses = list(user.weaknesses or [])
+    
+    # This is a simple algorithm - could be improved with better NLP
+    # Each section is applied on its own so a malformed one doesn't skip the other
+    if "Strengths" in sections:
+        try:
+            strengths = split_bullets(sections["Strengths"])
             
-            if any(term in strength.lower() for term in ["discovery", "question", "listen", "understanding"]):
-                skills["needs_discovery"] = min(100, skills.get("needs_discovery", 0) + 5)
+            # Increase skills mentioned in strengths
+            for skill, hits in count_skill_mentions(strengths).items():
+                skills[skill] = min(100, skills.get(skill, 0) + 5 * hits)
             
-            if any(term in strength.lower() for term in ["objection", "concern", "handle", "address"]):
-                skills["objection_handling"] = min(100, skills.get("objection_handling", 0) + 5)
+            # Add new items but avoid duplicates
+            add_unique(current_strengths, strengths)
+        except Exception:
+            logger.exception("update_user_stats failed on Strengths section")
+    
+    if "Areas for Improvement" in sections:
+        try:
+            weaknesses = split_bullets(sections["Areas for Improvement"])
             
-            if any(term in strength.lower() for term in ["close", "closing", "commitment", "decision"]):
-                skills["closing"] = min(100, skills.get("closing", 0) + 5)
+            # Slower increase for areas with weaknesses
+            for skill, hits in count_skill_mentions(weaknesses).items():
+                skills[skill] = max(1, skills.get(skill, 0) + 2 * hits)
             
-            if any(term in strength.lower() for term in ["product", "knowledge", "feature", "benefit"]):
-                skills["product_knowledge"] = min(100, skills.get("product_knowledge", 0) + 5)
-        
-        # Slower increase for areas with weaknesses
-        for weakness in weaknesses:
-            if "rapport" in weakness.lower():
-                skills["rapport_building"] = max(1, skills.get("rapport_building", 0) + 2)
-            
-            if any(term in weakness.lower() for term in ["discovery", "question", "listen", "understanding"]):
-                skills["needs_discovery"] = max(1, skills.get("needs_discovery", 0) + 2)
-            
-            if any(term in weakness.lower() for term in ["objection", "concern", "handle", "address"]):
-                skills["objection_handling"] = max(1, skills.get("objection_handling", 0) + 2)
-            
-            if any(term in weakness.lower() for term in ["close", "closing", "commitment", "decision"]):
-                skills["closing"] = max(1, skills.get("closing", 0) + 2)
-            
-            if any(term in weakness.lower() for term in ["product", "knowledge", "feature", "benefit"]):
-                skills["product_knowledge"] = max(1, skills.get("product_knowledge", 0) + 2)
-        
-        # Update user data
-        user.skills_dict = skills
-        
-        # Update strengths and weaknesses
-        current_strengths = user.strengths_list
-        current_weaknesses = user.weaknesses_list
-        
-        # Add new items but avoid duplicates
-        for strength in strengths:
-            if strength and strength not in current_strengths:
-                current_strengths.append(strength)
-        
-        for weakness in weaknesses:
-            if weakness and weakness not in current_weaknesses:
-                current_weaknesses.append(weakness)
-        
-        # Keep only the top items
-        user.strengths_list = current_strengths[:10]
-        user.weaknesses_list = current_weaknesses[:10]
-        
-    except Exception as e:
-        print(f"Error updating user stats: {e}")
+            add_unique(current_weaknesses, weaknesses)
+        except Exception:
+            logger.exception("update_user_stats failed on Areas for Improvement section")
+    
+    # Only changed ratings are updated; missing ones are added
+    for name, value in skills.items():
+        row = skill_rows.get(name)
+        if row is None:
+            db.session.add(UserSkill(user_id=user.id, skill=name, value=value))
+        elif row.value != value:
+            row.value = value
+    
+    # Write each list back once, keeping only the top items
+    user.strengths = current_strengths[:10]
+    user.weaknesses = current_weaknesses[:10]
@@ -4,20 +4,150 @@ Claude 3.7 Sonnet Extended API Service
 This module provides a unified interface for interacting with the Claude 3.7 Sonnet Extended API
 for the Sales Training AI application.
 """
+import atexit
+import hashlib
 import logging
+import random
+import re
+import threading
 import time
 import os
-from typing import List, Dict, Any, Optional
+from contextlib import ExitStack
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple, TypeVar, Union
 import anthropic
+import httpx
+import redis
+from config_manager import config
+from redis_client import redis_client
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
 # Constants
 MODEL_NAME = "claude-3-7-sonnet-20240219"  # Using Claude 3.7 Sonnet Extended
 MAX_TOKENS = 4000
 DEFAULT_TEMPERATURE = 0.7
 
+# HTTP settings shared by the Anthropic clients so calls reuse warm,
+# multiplexed connections instead of paying for a TLS handshake each time
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+HTTP_TIMEOUT = httpx.Timeout(120.0, connect=5.0)
+
+# Retry and circuit breaker settings: more than CIRCUIT_BREAKER_THRESHOLD
+# consecutive 429s within the window stops calls for the cooldown
+MAX_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 1.5
+MAX_RETRY_WAIT = 30.0
+CIRCUIT_BREAKER_THRESHOLD = 10
+CIRCUIT_BREAKER_WINDOW = 10
+CIRCUIT_BREAKER_COOLDOWN = config.get('CLAUDE_CIRCUIT_COOLDOWN', 30)
+
+# Persona cache: several variants per sales context, kept for 30 days
+PERSONA_VARIANTS = 5
+PERSONA_CACHE_TTL = 30 * 24 * 60 * 60
+
+_EXPERIENCE_PATTERN = re.compile(r'(\d+)\s*(year|yr|month|mo)')
+
+PERSONA_PROMPT_TEMPLATE = """Generate a detailed, realistic customer persona for a sales roleplay scenario. 
+This should be for a {customer} sales context.
+
+The customer should be interested in: {product}
+
+Include the following in your persona:
+1. Background information (name, age, role, company if B2B)
+2. Personality traits and communication style
+3. Specific needs and pain points related to the product/service
+4. Potential objections they might have
+5. Buying motivation and decision factors
+6. Make this persona thoughtfully calibrated to a salesperson with {experience} experience level
+
+Create a rich, detailed character that feels like a real person with genuine concerns and interests.
+"""
+
+# Roleplay instructions shared by every conversation; kept ahead of the
+# per-conversation context so it forms a stable, cacheable prefix
+ROLEPLAY_PREFIX = """You are roleplaying as a customer in a sales training conversation. Your persona is described below.
+
+Your job is to respond naturally as this customer would, based on the conversation history. 
+You should raise appropriate objections and ask questions while being realistic.
+
+Guidelines:
+- Stay in character as the customer at all times
+- Respond conversationally and naturally 
+- Express appropriate emotions and hesitations
+- Never break character to explain what you're doing
+- Be somewhat skeptical but not unreasonably difficult
+- Ask questions that a real customer would ask
+- Raise realistic objections about price, features, or alternatives
+- React to how well the salesperson addresses your needs and concerns
+"""
+
+ROLEPLAY_CONTEXT_TEMPLATE = """Your persona:
+
+{persona}
+
+The person you're talking to is a salesperson with {experience} experience selling {product}.
+"""
+
+SUMMARY_SYSTEM_PROMPT = """Summarize this sales roleplay between a salesperson and a customer so the customer can carry on the conversation consistently.
+Preserve concrete facts shared by either side, every objection raised and how it was answered, and any decisions or commitments made.
+Write in the third person and keep it under 200 words.
+"""
+
+FEEDBACK_SYSTEM_PROMPT = """Analyze this sales roleplay conversation between a salesperson (user) and a customer (assistant).
+Provide detailed, constructive feedback with these clearly labeled sections:
+
+### Strengths
+Highlight what the salesperson did well, with specific examples from the conversation.
+
+### Areas for Improvement
+Identify specific opportunities the salesperson missed or things they could have handled better.
+
+### Actionable Recommendations
+Provide 3-5 concrete techniques, phrases, or approaches the salesperson could implement in future conversations.
+
+Be specific, balanced, and focus on practical advice that will help them improve their sales skills.
+"""
+
+def normalize_sales_info(sales_info: Dict[str, Any]) -> Tuple[str, str, str]:
+    """
+    Reduce sales context to the buckets that matter for persona generation.
+    
+    Args:
+        sales_info: Dictionary with 'product_service', 'target_market', and 'sales_experience'
+        
+    Returns:
+        Tuple of (product, market, experience): product lowercased with
+        whitespace collapsed, market one of B2B/B2C/mixed, and experience
+        one of beginner/intermediate/experienced
+    """
+    product = " ".join((sales_info.get('product_service') or '').lower().split())
+    
+    market = (sales_info.get('target_market') or '').strip().upper()
+    if market not in ('B2B', 'B2C'):
+        market = 'mixed'
+    
+    experience = (sales_info.get('sales_experience') or 'intermediate').lower()
+    match = _EXPERIENCE_PATTERN.search(experience)
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        years = amount if unit in ('year', 'yr') else amount / 12
+        if years < 2:
+            experience = 'beginner'
+        elif years < 5:
+            experience = 'intermediate'
+        else:
+            experience = 'experienced'
+    elif experience not in ('beginner', 'intermediate', 'experienced'):
+        experience = 'intermediate'
+    
+    return product, market, experience
+
+class ClaudeUnavailableError(RuntimeError):
+    """Raised without calling the API while the circuit breaker is open."""
+
 class ClaudeService:
     """Service for interacting with Claude 3.7 Sonnet Extended API."""
     
@@ -40,15 +170,49 @@ class ClaudeService:
         if not self.api_key:
             raise ValueError("Anthropic API key is required")
         
-        # Initialize the Anthropic client
-        self.client = anthropic.Anthropic(api_key=self.api_key)
+        # Initialize the Anthropic client on one HTTP/2 connection pool
+        self.http_client = anthropic.DefaultHttpxClient(
+            transport=httpx.HTTPTransport(http2=True, limits=HTTP_LIMITS, retries=0),
+            timeout=HTTP_TIMEOUT
+        )
+        atexit.register(self.http_client.close)
+        # Retries are handled here so they can honour Retry-After and the
+        # circuit breaker, so the SDK's own retries are turned off
+        self.client = anthropic.Anthropic(
+            api_key=self.api_key,
+            http_client=self.http_client,
+            max_retries=0
+        )
+        
+        # Rate-limit circuit breaker state
+        self._circuit_lock = threading.Lock()
+        self._rate_limit_hits = []
+        self._circuit_open_until = 0.0
+
         self._initialized = True
         logger.info("Claude API service initialized")
     
+    @staticmethod
+    def _format_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        Format conversation history for the Anthropic API.
+        
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            
+        Returns:
+            List of messages with empty entries removed
+        """
+        return [
+            {"role": msg['role'], "content": msg['content']}
+            for msg in messages
+            if msg.get('role') and msg.get('content')
+        ]
+    
     def generate_response(
         self, 
         messages: List[Dict[str, str]],
-        system_prompt: str = "",
+        system_prompt: Union[str, List[Dict[str, Any]]] = "",
         temperature: float = DEFAULT_TEMPERATURE,
         max_tokens: int = MAX_TOKENS
     ) -> str:
@@ -57,7 +221,7 @@ class ClaudeService:
         
         Args:
             messages: List of message dictionaries with 'role' and 'content'
-            system_prompt: System prompt for the model
+            system_prompt: System prompt for the model, as text or content blocks
             temperature: Sampling temperature (0.0 to 1.0)
             max_tokens: Maximum tokens to generate
             
@@ -66,64 +230,166 @@ class ClaudeService:
         """
         try:
             # Format messages for Anthropic API
-            formatted_messages = []
-            for msg in messages:
-                if msg.get('role') and msg.get('content'):
-                    # Map 'assistant' role to 'assistant' for Anthropic
-                    role = msg['role']
-                    if role == 'assistant':
-                        role = 'assistant'
-                    formatted_messages.append({
-                        "role": role,
-                        "content": msg['content']
-                    })
-            
-            # Call the API with retry logic
-            max_retries = 3
-            backoff_factor = 1.5
+            formatted_messages = self._format_messages(messages)
             
-            for attempt in range(max_retries):
-                try:
-                    start_time = time.time()
-                    response = self.client.messages.create(
-                        model=MODEL_NAME,
-                        system=system_prompt,
-                        messages=formatted_messages,
-                        max_tokens=max_tokens,
-                        temperature=temperature
-                    )
-                    duration = time.time() - start_time
-                    logger.info(f"Claude API request completed in {duration:.2f}s")
-                    
-                    # Extract the assistant's response
-                    if response and response.content:
-                        return response.content[0].text
-                    else:
-                        logger.warning("Empty response received from Claude API")
-                        return ""
-                        
-                except anthropic.RateLimitError as e:
-                    if attempt < max_retries - 1:
-                        wait_time = backoff_factor ** attempt
-                        logger.warning(f"Rate limit exceeded, retrying in {wait_time}s. Error: {e}")
-                        time.sleep(wait_time)
-                    else:
-                        raise
-                except (anthropic.APIError, anthropic.APIConnectionError) as e:
-                    if attempt < max_retries - 1:
-                        wait_time = backoff_factor ** attempt
-                        logger.warning(f"API error, retrying in {wait_time}s. Error: {e}")
-                        time.sleep(wait_time)
-                    else:
-                        raise
+            start_time = time.time()
+            response = self._with_retries(lambda: self.client.messages.create(
+                model=MODEL_NAME,
+                system=system_prompt,
+                messages=formatted_messages,
+                max_tokens=max_tokens,
+                temperature=temperature
+            ))
+            duration = time.time() - start_time
+            logger.info(f"Claude API request completed in {duration:.2f}s")
             
-            # If we get here, all retries failed
-            raise RuntimeError("Failed to get response after multiple retries")
+            # Extract the assistant's response
+            if response and response.content:
+                return response.content[0].text
+            else:
+                logger.warning("Empty response received from Claude API")
+                return ""
                 
         except Exception as e:
             logger.error(f"Error generating Claude response: {str(e)}")
             raise
     
+    def _check_circuit(self) -> None:
+        """Fail fast while the rate-limit circuit breaker is open."""
+        if time.time() < self._circuit_open_until:
+            raise ClaudeUnavailableError("Claude API is rate limiting requests; try again shortly")
+    
+    def _record_rate_limit(self) -> None:
+        """Count a 429, opening the circuit if they keep coming."""
+        now = time.time()
+        with self._circuit_lock:
+            self._rate_limit_hits = [
+                hit for hit in self._rate_limit_hits if now - hit < CIRCUIT_BREAKER_WINDOW
+            ]
+            self._rate_limit_hits.append(now)
+            if len(self._rate_limit_hits) > CIRCUIT_BREAKER_THRESHOLD:
+                self._circuit_open_until = now + CIRCUIT_BREAKER_COOLDOWN
+                self._rate_limit_hits = []
+                logger.error(f"Claude API circuit open for {CIRCUIT_BREAKER_COOLDOWN}s after repeated rate limits")
+    
+    def _record_success(self) -> None:
+        """Reset the consecutive rate-limit count."""
+        if self._rate_limit_hits:
+            with self._circuit_lock:
+                self._rate_limit_hits = []
+    
+    @staticmethod
+    def _retry_delay(error: Exception, default: float) -> float:
+        """
+        Work out how long to wait before retrying a failed request.
+        
+        Args:
+            error: The exception raised by the API call
+            default: Backoff to use when the server doesn't say
+            
+        Returns:
+            Seconds to wait, including up to 30% jitter
+        """
+        wait_time = default
+        response = getattr(error, 'response', None)
+        if response is not None:
+            headers = response.headers
+            try:
+                if 'retry-after-ms' in headers:
+                    wait_time = float(headers['retry-after-ms']) / 1000
+                elif 'retry-after' in headers:
+                    wait_time = float(headers['retry-after'])
+            except ValueError:
+                pass  # HTTP-date form, fall back to the backoff
+        
+        wait_time = min(max(wait_time, 0.0), MAX_RETRY_WAIT)
+        return wait_time + random.uniform(0, 0.3 * wait_time)
+    
+    def _with_retries(self, request: Callable[[], T]) -> T:
+        """
+        Make an API request, retrying API and connection errors with backoff.
+        
+        Every attempt is checked against the circuit breaker first, and rate
+        limits count towards opening it.
+        
+        Args:
+            request: Makes a single attempt and returns its result
+            
+        Returns:
+            The result of the first successful attempt
+        """
+        for attempt in range(MAX_RETRIES):
+            try:
+                self._check_circuit()
+                result = request()
+                self._record_success()
+                return result
+                
+            except (anthropic.APIError, anthropic.APIConnectionError) as e:
+                if isinstance(e, anthropic.RateLimitError):
+                    self._record_rate_limit()
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                wait_time = self._retry_delay(e, RETRY_BACKOFF_FACTOR ** attempt)
+                logger.warning(f"API error, retrying in {wait_time:.2f}s. Error: {e}")
+                time.sleep(wait_time)
+    
+    def generate_response_stream(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: Union[str, List[Dict[str, Any]]] = "",
+        temperature: float = DEFAULT_TEMPERATURE,
+        max_tokens: int = MAX_TOKENS
+    ) -> Iterator[str]:
+        """
+        Stream a response from Claude as it is generated.
+        
+        Retries only apply until the first chunk has been yielded; once text
+        has reached the caller a failure is raised rather than restarting the
+        response from the beginning.
+        
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            system_prompt: System prompt for the model, as text or content blocks
+            temperature: Sampling temperature (0.0 to 1.0)
+            max_tokens: Maximum tokens to generate
+            
+        Yields:
+            Chunks of generated text
+        """
+        formatted_messages = self._format_messages(messages)
+        start_time = time.time()
+        
+        def open_stream():
+            # An attempt covers everything up to the first chunk
+            stack = ExitStack()
+            try:
+                stream = stack.enter_context(self.client.messages.stream(
+                    model=MODEL_NAME,
+                    system=system_prompt,
+                    messages=formatted_messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature
+                ))
+                chunks = iter(stream.text_stream)
+                first = next(chunks, None)
+            except BaseException:
+                stack.close()
+                raise
+            return stack, first, chunks
+        
+        stack, first, chunks = self._with_retries(open_stream)
+        logger.info(f"Claude API first token after {time.time() - start_time:.2f}s")
+        try:
+            with stack:
+                if first is not None:
+                    yield first
+                yield from chunks
+        except (anthropic.APIError, anthropic.APIConnectionError) as e:
+            logger.error(f"Error streaming Claude response: {str(e)}")
+            raise
+        logger.info(f"Claude API stream completed in {time.time() - start_time:.2f}s")
+    
     def generate_customer_persona(self, sales_info: Dict[str, Any]) -> str:
         """
         Generate a detailed customer persona based on sales context.
@@ -134,37 +400,49 @@ class ClaudeService:
         Returns:
             Detailed customer persona text
         """
-        # Extract the info we need
-        product = sales_info.get('product_service', '')
-        market = sales_info.get('target_market', '')
-        experience = sales_info.get('sales_experience', 'intermediate')
+        # Normalize the inputs so equivalent contexts share cached personas
+        product, market, experience = normalize_sales_info(sales_info)
+        cache_key = "persona:" + hashlib.sha256(
+            f"{product}|{market}|{experience}".encode()
+        ).hexdigest()
+        
+        try:
+            variants = redis_client.lrange(cache_key, 0, -1)
+            if len(variants) >= PERSONA_VARIANTS:
+                return random.choice(variants).decode()
+        except redis.RedisError as e:
+            logger.warning(f"Persona cache unavailable: {e}")
         
         # Create the system prompt for persona generation
-        system_prompt = f"""Generate a detailed, realistic customer persona for a sales roleplay scenario. 
-This should be for a {'business customer (B2B)' if 'b2b' in market.lower() else 'consumer (B2C)'} sales context.
-
-The customer should be interested in: {product}
-
-Include the following in your persona:
-1. Background information (name, age, role, company if B2B)
-2. Personality traits and communication style
-3. Specific needs and pain points related to the product/service
-4. Potential objections they might have
-5. Buying motivation and decision factors
-6. Make this persona thoughtfully calibrated to a salesperson with {experience} experience level
-
-Create a rich, detailed character that feels like a real person with genuine concerns and interests.
-"""
+        system_prompt = PERSONA_PROMPT_TEMPLATE.format(
+            customer='business customer (B2B)' if market == 'B2B' else 'consumer (B2C)',
+            product=product,
+            experience=experience
+        )
         
         # Send the request to Claude
         messages = []  # No conversation history for persona generation
-        return self.generate_response(messages, system_prompt, temperature=0.8)
+        persona = self.generate_response(messages, system_prompt, temperature=0.8)
+        
+        # Keep up to PERSONA_VARIANTS personas per context for variety on hits
+        if persona:
+            try:
+                pipe = redis_client.pipeline()
+                pipe.rpush(cache_key, persona)
+                pipe.ltrim(cache_key, -PERSONA_VARIANTS, -1)
+                pipe.expire(cache_key, PERSONA_CACHE_TTL)
+                pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f"Could not cache persona: {e}")
+        
+        return persona
     
     def generate_roleplay_response(
         self, 
         conversation_history: List[Dict[str, str]], 
         persona: str,
-        sales_info: Dict[str, Any]
+        sales_info: Dict[str, Any],
+        summary: Optional[str] = None
     ) -> str:
         """
         Generate a roleplay response based on conversation history.
@@ -173,33 +451,98 @@ Create a rich, detailed character that feels like a real person with genuine con
             conversation_history: List of message dictionaries with 'role' and 'content'
             persona: The customer persona description
             sales_info: Dictionary with sales context information
+            summary: Summary of earlier turns not included in the history
             
         Returns:
             Generated roleplay response
         """
-        # Create the system prompt for the roleplay
-        system_prompt = f"""You are roleplaying as a customer with the following persona:
-
-{persona}
-
-Your job is to respond naturally as this customer would, based on the conversation history. 
-You should raise appropriate objections and ask questions while being realistic.
-The person you're talking to is a salesperson with {sales_info.get('sales_experience', 'some')} experience selling {sales_info.get('product_service', 'their product/service')}.
-
-Guidelines:
-- Stay in character as the customer at all times
-- Respond conversationally and naturally 
-- Express appropriate emotions and hesitations
-- Never break character to explain what you're doing
-- Be somewhat skeptical but not unreasonably difficult
-- Ask questions that a real customer would ask
-- Raise realistic objections about price, features, or alternatives
-- React to how well the salesperson addresses your needs and concerns
-"""
+        system_prompt = self._roleplay_system_prompt(persona, sales_info, summary)
         
         # Send the request to Claude
         return self.generate_response(conversation_history, system_prompt)
     
+    def generate_roleplay_response_stream(
+        self,
+        conversation_history: List[Dict[str, str]],
+        persona: str,
+        sales_info: Dict[str, Any],
+        summary: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        Stream a roleplay response based on conversation history.
+        
+        Args:
+            conversation_history: List of message dictionaries with 'role' and 'content'
+            persona: The customer persona description
+            sales_info: Dictionary with sales context information
+            summary: Summary of earlier turns not included in the history
+            
+        Yields:
+            Chunks of the roleplay response
+        """
+        system_prompt = self._roleplay_system_prompt(persona, sales_info, summary)
+        return self.generate_response_stream(conversation_history, system_prompt)
+    
+    @staticmethod
+    def _roleplay_system_prompt(
+        persona: str,
+        sales_info: Dict[str, Any],
+        summary: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Build the system prompt for the customer roleplay.
+        
+        The invariant instructions come first and the per-conversation context
+        block is marked for prompt caching, so every turn of a conversation
+        reuses the cached prefix. The summary changes as the conversation
+        goes on, so it follows the cache breakpoint.
+        """
+        context = ROLEPLAY_CONTEXT_TEMPLATE.format(
+            persona=persona,
+            experience=sales_info.get('sales_experience') or 'some',
+            product=sales_info.get('product_service') or 'their product/service'
+        )
+        blocks = [
+            {"type": "text", "text": ROLEPLAY_PREFIX},
+            {"type": "text", "text": context, "cache_control": {"type": "ephemeral"}},
+        ]
+        if summary:
+            blocks.append({
+                "type": "text",
+                "text": f"What has happened earlier in this conversation:\n{summary}"
+            })
+        return blocks
+    
+    def generate_conversation_summary(
+        self,
+        messages: List[Dict[str, str]],
+        previous_summary: Optional[str] = None
+    ) -> str:
+        """
+        Summarize conversation turns, folding in any earlier summary.
+        
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            previous_summary: Summary of the turns before these messages
+            
+        Returns:
+            Updated summary text
+        """
+        # Sent as one transcript so the turns can start with either role
+        transcript = "\n\n".join(
+            f"{'Salesperson' if msg['role'] == 'user' else 'Customer'}: {msg['content']}"
+            for msg in messages
+        )
+        if previous_summary:
+            transcript = f"Summary so far:\n{previous_summary}\n\nLater conversation:\n{transcript}"
+        
+        return self.generate_response(
+            [{'role': 'user', 'content': transcript}],
+            SUMMARY_SYSTEM_PROMPT,
+            temperature=0.2,
+            max_tokens=500
+        )
+    
     def generate_feedback(self, conversation_history: List[Dict[str, str]]) -> str:
         """
         Generate feedback on a sales conversation.
@@ -210,23 +553,21 @@ Guidelines:
         Returns:
             Structured feedback on the sales conversation
         """
-        system_prompt = """Analyze this sales roleplay conversation between a salesperson (user) and a customer (assistant).
-Provide detailed, constructive feedback with these clearly labeled sections:
-
-### Strengths
-Highlight what the salesperson did well, with specific examples from the conversation.
-
-### Areas for Improvement
-Identify specific opportunities the salesperson missed or things they could have handled better.
-
-### Actionable Recommendations
-Provide 3-5 concrete techniques, phrases, or approaches the salesperson could implement in future conversations.
-
-Be specific, balanced, and focus on practical advice that will help them improve their sales skills.
-"""
-        
         # Send the request to Claude with lower temperature for more consistent feedback
-        return self.generate_response(conversation_history, system_prompt, temperature=0.3)
+        return self.generate_response(conversation_history, FEEDBACK_SYSTEM_PROMPT, temperature=0.3)
+
+def get_claude_service() -> ClaudeService:
+    """
+    Get the shared Claude service, creating it on first use.
+    
+    Returns:
+        The ClaudeService singleton
+    """
+    return ClaudeService()
 
-# Create a singleton instance for import and use elsewhere
-claude_service = ClaudeService()
+def __getattr__(name: str) -> Any:
+    """Create the module-level claude_service lazily on first access (PEP 562)."""
+    if name == "claude_service":
+        service = globals()["claude_service"] = get_claude_service()
+        return service
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -5,8 +5,8 @@ This module provides a secure way to manage application configuration and sensit
 """
 
 import os
-import logging
 import secrets
+import logging
 from typing import Any, Dict, Optional
 from dotenv import load_dotenv
 
@@ -17,6 +17,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger("ConfigManager")
 
+# Generated development secret shared by all workers and restarts
+DEV_SECRET_FILE = '.flask_secret'
+
 class ConfigManager:
     """Secure configuration manager that handles environment variables and sensitive credentials."""
     
@@ -48,13 +51,19 @@ class ConfigManager:
         # Core application settings
         self._config = {
             # Flask settings
-            'FLASK_SECRET_KEY': os.getenv('FLASK_SECRET_KEY', secrets.token_hex(32)),
+            'FLASK_SECRET_KEY': os.getenv('FLASK_SECRET_KEY'),
             'FLASK_DEBUG': os.getenv('FLASK_DEBUG', 'False').lower() == 'true',
             'FLASK_HOST': os.getenv('FLASK_HOST', '0.0.0.0'),
             'FLASK_PORT': int(os.getenv('FLASK_PORT', '5000')),
+            'RAISE_ON_LAZY_LOAD': os.getenv('RAISE_ON_LAZY_LOAD', 'False').lower() == 'true',
             
             # API Keys
             'ANTHROPIC_API_KEY': os.getenv('ANTHROPIC_API_KEY'),
+            'CLAUDE_CIRCUIT_COOLDOWN': int(os.getenv('CLAUDE_CIRCUIT_COOLDOWN', '30')),  # Seconds
+            
+            # Redis settings
+            'REDIS_URL': os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+            'REDIS_MAX_CONNECTIONS': int(os.getenv('REDIS_MAX_CONNECTIONS', '50')),
             
             # Google OAuth settings
             'GOOGLE_CLIENT_ID': os.getenv('GOOGLE_CLIENT_ID'),
@@ -68,15 +77,58 @@ class ConfigManager:
             'SESSION_COOKIE_SAMESITE': 'Lax',
             'CSRF_ENABLED': True,
             'PASSWORD_MIN_LENGTH': int(os.getenv('PASSWORD_MIN_LENGTH', '8')),
+            'PASSWORD_HASH_TARGET_MS': int(os.getenv('PASSWORD_HASH_TARGET_MS', '80')),
+            'ARGON2_TIME_COST': int(os.getenv('ARGON2_TIME_COST', '0')) or None,  # From `python models.py`
             'RATE_LIMIT_WINDOW': int(os.getenv('RATE_LIMIT_WINDOW', '60')),  # Window in seconds
             'RATE_LIMIT': int(os.getenv('RATE_LIMIT', '10')),  # Max requests per window
             'MAX_LOGIN_ATTEMPTS': int(os.getenv('MAX_LOGIN_ATTEMPTS', '5')),
             'LOCKOUT_TIME': int(os.getenv('LOCKOUT_TIME', '300')),  # Seconds
+            'LOGIN_MIN_DURATION_MS': int(os.getenv('LOGIN_MIN_DURATION_MS', '300')),
         }
         
+        # Resolve the secret key before anything signs with it
+        self._config['FLASK_SECRET_KEY'] = self._resolve_secret_key()
+        
         # Check for required API keys
         self._validate_required_keys()
     
+    def _resolve_secret_key(self) -> str:
+        """
+        Get the Flask secret key, identical across all worker processes.
+        
+        FLASK_SECRET_KEY is required in production, and a missing key stops the
+        process at import rather than on the first request. In development a
+        generated key is persisted to DEV_SECRET_FILE so every worker signs
+        sessions alike.
+        
+        Returns:
+            The secret key
+        """
+        secret = self._config.get('FLASK_SECRET_KEY')
+        if secret:
+            return secret
+        
+        if self.is_production():
+            raise RuntimeError("FLASK_SECRET_KEY must be set in production")
+        
+        if not os.path.exists(DEV_SECRET_FILE):
+            # Write to a temp file and link it into place so concurrent workers agree
+            tmp_path = f"{DEV_SECRET_FILE}.{os.getpid()}"
+            with open(tmp_path, 'w') as f:
+                f.write(secrets.token_hex(32))
+            try:
+                os.link(tmp_path, DEV_SECRET_FILE)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp_path)
+        
+        with open(DEV_SECRET_FILE) as f:
+            secret = f.read().strip()
+        
+        logger.warning(f"FLASK_SECRET_KEY not set, using development key from {DEV_SECRET_FILE}")
+        return secret
+    
     def _validate_required_keys(self) -> None:
         """Validate that required API keys are present."""
         required_keys = ['ANTHROPIC_API_KEY', 'FLASK_SECRET_KEY']
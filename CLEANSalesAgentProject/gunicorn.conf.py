@@ -0,0 +1,20 @@
+"""
+Gunicorn configuration for the Sales Training AI application.
+
+Run in production with:
+    gunicorn -c gunicorn.conf.py "app:create_app()"
+
+Workers use gevent so requests blocked on outbound HTTPS (Google OAuth,
+the Claude API) yield to other requests instead of pinning a worker.
+"""
+import os
+
+# Flask settings (read directly; the app itself is only imported in workers,
+# after gevent has patched the standard library)
+bind = f"{os.getenv('FLASK_HOST', '0.0.0.0')}:{os.getenv('FLASK_PORT', '5000')}"
+
+# Worker settings
+worker_class = 'gevent'
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '1000'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))  # Claude calls can take tens of seconds
@@ -5,9 +5,10 @@ Run this script to create the initial database schema.
 """
 
 import os
+import json
 from flask import Flask
-from models import db, User
-from werkzeug.security import generate_password_hash
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, User, UserSkill, DEFAULT_SKILLS, password_hasher
 import logging
 
 logging.basicConfig(
@@ -16,53 +17,91 @@ logging.basicConfig(
 )
 logger = logging.getLogger("DatabaseInit")
 
+# Starting skill ratings for the admin account
+ADMIN_SKILLS = {
+    "rapport_building": 80,
+    "needs_discovery": 85,
+    "objection_handling": 90,
+    "closing": 85,
+    "product_knowledge": 95
+}
+
+def migrate_sales_skills():
+    """
+    Copy skill ratings from the old user.sales_skills JSON column into user_skill.
+    
+    Databases created before the user_skill table still have the column;
+    new ones don't, and the step is skipped. It is safe to run repeatedly:
+    existing user_skill rows are kept, and any skill a user has no rating
+    for gets its DEFAULT_SKILLS value, as for new accounts.
+    """
+    columns = [row[1] for row in db.session.execute(db.text('PRAGMA table_info("user")'))]
+    if 'sales_skills' not in columns:
+        return
+    
+    copied = db.session.execute(db.text(
+        'INSERT OR IGNORE INTO user_skill (user_id, skill, value) '
+        'SELECT "user".id, skills.key, CAST(skills.value AS INTEGER) '
+        'FROM "user", json_each("user".sales_skills) AS skills '
+        'WHERE json_valid("user".sales_skills) AND json_type("user".sales_skills) = \'object\''
+    )).rowcount
+    defaulted = db.session.execute(db.text(
+        'INSERT OR IGNORE INTO user_skill (user_id, skill, value) '
+        'SELECT "user".id, skills.key, skills.value '
+        'FROM "user", json_each(:defaults) AS skills'
+    ), {'defaults': json.dumps(DEFAULT_SKILLS)}).rowcount
+    db.session.commit()
+    logger.info(f"Migrated sales_skills: {copied} ratings copied, {defaulted} defaults added")
+
 def init_db():
     """Initialize the database with required tables."""
     # Create a minimal Flask app for this script
     app = Flask(__name__)
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///instance/salestrainer.db'
+    # Relative SQLite paths resolve inside the instance folder, as in app.py
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///salestrainer.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
     # Initialize SQLAlchemy with this app
     db.init_app(app)
     
     # Ensure the instance folder exists
-    os.makedirs('instance', exist_ok=True)
+    os.makedirs(app.instance_path, exist_ok=True)
     
     with app.app_context():
+        # The connect hook in models sets the pragmas; WAL persists in the file
+        journal_mode = db.session.execute(db.text("PRAGMA journal_mode")).scalar()
+        logger.info(f"SQLite journal mode: {journal_mode}")
+        
         logger.info("Creating database tables...")
         db.create_all()
+        migrate_sales_skills()
         
         # Check if we need to create an admin user
         admin_email = os.environ.get('ADMIN_EMAIL')
         admin_password = os.environ.get('ADMIN_PASSWORD')
         
         if admin_email and admin_password:
-            existing_admin = User.query.filter_by(email=admin_email).first()
-            
-            if not existing_admin:
-                logger.info(f"Creating admin user: {admin_email}")
-                admin = User(
+            # A single INSERT that leaves an existing admin account untouched
+            result = db.session.execute(
+                sqlite_insert(User).values(
                     name="Administrator",
                     email=admin_email,
-                    role="admin"
-                )
-                admin.set_password(admin_password)
-                
-                # Initialize default skills
-                admin.skills_dict = {
-                    "rapport_building": 80,
-                    "needs_discovery": 85,
-                    "objection_handling": 90,
-                    "closing": 85,
-                    "product_knowledge": 95
-                }
-                
-                db.session.add(admin)
-                db.session.commit()
-                logger.info("Admin user created successfully")
+                    role="admin",
+                    password_hash=password_hasher.hash(admin_password)
+                ).on_conflict_do_nothing(index_elements=['email'])
+            )
+            
+            if result.rowcount:
+                # Core inserts skip the ORM's default skills, so add the admin's here
+                admin_id = result.inserted_primary_key[0]
+                db.session.execute(sqlite_insert(UserSkill), [
+                    {'user_id': admin_id, 'skill': skill, 'value': value}
+                    for skill, value in ADMIN_SKILLS.items()
+                ])
+                logger.info(f"Admin user created: {admin_email}")
             else:
                 logger.info("Admin user already exists")
+            db.session.commit()
         
         logger.info("Database initialization completed successfully")
 
@@ -4,94 +4,286 @@ Database models for the Sales Training AI application.
 This module provides SQLAlchemy models for users, conversations, and messages.
 """
 
+import time
+import zlib
+import sqlite3
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, func
+from sqlalchemy.types import TypeDecorator, LargeBinary
+from sqlalchemy.engine import Engine
+from werkzeug.security import check_password_hash
 from flask_login import UserMixin
-import json
+from argon2 import PasswordHasher, Type, extract_parameters
+from argon2.exceptions import VerificationError, InvalidHash
+from sqlalchemy.ext.mutable import MutableList
+from sqlalchemy.orm import attribute_keyed_dict, deferred
+from config_manager import config
 
 db = SQLAlchemy()
 
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Tune every new SQLite connection for concurrent web traffic.
+    
+    Registered when this module is imported, so the app and init_db both get
+    it. journal_mode=WAL is stored in the database file and stays on once set;
+    the other pragmas only last for the connection.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+# Starting skill ratings for new users
+DEFAULT_SKILLS = {
+    "rapport_building": 0,
+    "needs_discovery": 0,
+    "objection_handling": 0,
+    "closing": 0,
+    "product_knowledge": 0
+}
+
+# Argon2id parameters (OWASP minimum); time cost comes from ARGON2_TIME_COST
+ARGON2_MEMORY_COST = 19 * 1024  # KiB
+ARGON2_PARALLELISM = 1
+ARGON2_MIN_TIME_COST = 2
+ARGON2_MAX_TIME_COST = 10
+ARGON2_DEFAULT_TIME_COST = 3
+
+def calibrate_time_cost() -> int:
+    """
+    Find the Argon2 time cost that fits the configured hashing budget.
+    
+    Times one hash at the minimum cost and scales the time cost so a hash
+    takes roughly PASSWORD_HASH_TARGET_MS on this machine. Run it once per
+    deployment (python models.py) and set ARGON2_TIME_COST to the result, so
+    every process hashes with the same cost.
+    
+    Returns:
+        The calibrated time cost
+    """
+    target = config.get('PASSWORD_HASH_TARGET_MS', 80) / 1000
+    
+    hasher = PasswordHasher(
+        time_cost=ARGON2_MIN_TIME_COST,
+        memory_cost=ARGON2_MEMORY_COST,
+        parallelism=ARGON2_PARALLELISM
+    )
+    start = time.perf_counter()
+    hasher.hash("calibration")
+    elapsed = time.perf_counter() - start
+    
+    time_cost = round(ARGON2_MIN_TIME_COST * target / elapsed)
+    return max(ARGON2_MIN_TIME_COST, min(ARGON2_MAX_TIME_COST, time_cost))
+
+# A fixed default, never calibrated at import, so every process hashes alike
+ARGON2_TIME_COST = max(ARGON2_MIN_TIME_COST, config.get('ARGON2_TIME_COST') or ARGON2_DEFAULT_TIME_COST)
+
+password_hasher = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM
+)
+
+# Verified against when an account doesn't exist so misses cost a real hash
+_dummy_password_hash = None
+
+def dummy_password_hash():
+    """Get the hash to verify against for unknown accounts, hashing it on first use."""
+    global _dummy_password_hash
+    if _dummy_password_hash is None:
+        _dummy_password_hash = run_off_loop(password_hasher.hash, "dummy-password")
+    return _dummy_password_hash
+
+def run_off_loop(func, *args):
+    """
+    Run CPU-heavy work on a real OS thread when gevent is serving requests.
+    
+    Under gevent, hashing on the request's greenlet stalls every other request
+    in the worker for the length of the hash; the threadpool runs it on a real
+    thread (argon2 releases the GIL) while the hub keeps switching. Without
+    gevent the call runs directly, as a pool would only add a hand-off.
+    
+    Args:
+        func: The function to call
+        *args: Arguments for the function
+        
+    Returns:
+        The function's return value
+    """
+    if _threading_patched():
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args)
+    return func(*args)
+
+def _threading_patched():
+    """Check whether gevent has monkey-patched threading in this process."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+def _verify_password_hash(password_hash, password):
+    if password_hash.startswith('$argon2'):
+        try:
+            return password_hasher.verify(password_hash, password)
+        except (VerificationError, InvalidHash):
+            return False
+    
+    return check_password_hash(password_hash, password)
+
+def verify_password_hash(password_hash, password):
+    """Check a password against an Argon2id hash or a legacy Werkzeug hash."""
+    if not password_hash:
+        return False
+    return run_off_loop(_verify_password_hash, password_hash, password)
+
+def password_needs_rehash(password_hash):
+    """
+    Check if a stored hash is legacy or uses outdated Argon2 parameters.
+    
+    Only a time cost below the configured one counts as outdated; a higher one
+    is kept, so lowering ARGON2_TIME_COST doesn't rehash every account.
+    """
+    if not password_hash.startswith('$argon2'):
+        return True
+    
+    try:
+        params = extract_parameters(password_hash)
+    except InvalidHash:
+        return True
+    
+    return (
+        params.type is not Type.ID
+        or params.memory_cost != ARGON2_MEMORY_COST
+        or params.parallelism != ARGON2_PARALLELISM
+        or params.time_cost < ARGON2_TIME_COST
+    )
+
+# Text shorter than this is stored as plain UTF-8; compressing it saves little
+COMPRESS_MIN_BYTES = 512
+
+# Marks compressed values; 0xFF never starts valid UTF-8 text
+_COMPRESSED_MARKER = b'\xff'
+
+class CompressedText(TypeDecorator):
+    """
+    Text stored as a BLOB, zlib-compressed once it is long enough to benefit.
+    
+    Rows written as TEXT before the column held BLOBs are still read as-is.
+    """
+    impl = LargeBinary
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        raw = value.encode('utf-8')
+        if len(raw) < COMPRESS_MIN_BYTES:
+            return raw
+        return _COMPRESSED_MARKER + zlib.compress(raw, 6)
+    
+    def result_processor(self, dialect, coltype):
+        # Skip LargeBinary's own processing, which fails on legacy TEXT values
+        return lambda value: self.process_result_value(value, dialect)
+    
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        if value[:1] == _COMPRESSED_MARKER:
+            value = zlib.decompress(value[1:])
+        return bytes(value).decode('utf-8')
+
+# JSON list column that tracks in-place changes, shared by the list columns
+JsonList = MutableList.as_mutable(db.JSON)
+
 class User(db.Model, UserMixin):
     """User model for authentication and profile data."""
     
+    __table_args__ = (
+        db.Index('ix_user_email', 'email', unique=True),
+        # Only Google accounts have an id, so password-only users stay out of the index
+        db.Index('ix_user_google_id', 'google_id', unique=True,
+                 sqlite_where=db.text('google_id IS NOT NULL')),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    email = db.Column(db.String(100), unique=True, nullable=False)
+    email = db.Column(db.String(100), nullable=False)
     password_hash = db.Column(db.String(200))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, server_default=func.current_timestamp(), nullable=False)
+    updated_at = db.Column(db.DateTime, server_default=func.current_timestamp(),
+                           onupdate=func.current_timestamp(), nullable=False)
     
     # User role (admin, user)
     role = db.Column(db.String(20), default='user')
     
     # User stats and training data
     completed_roleplays = db.Column(db.Integer, default=0)
-    sales_skills = db.Column(db.Text, default='{}')  # JSON string with skill ratings
-    strengths = db.Column(db.Text, default='[]')     # JSON string with strengths list
-    weaknesses = db.Column(db.Text, default='[]')    # JSON string with areas to improve
+    # Only the dashboard and stats updates read these, so they load together on
+    # first access rather than with the user on every request
+    strengths = deferred(db.Column(JsonList, default=list, nullable=False), group='stats')     # Strengths list
+    weaknesses = deferred(db.Column(JsonList, default=list, nullable=False), group='stats')    # Areas to improve
     
     # Google Auth
-    google_id = db.Column(db.String(100), unique=True, nullable=True)
+    google_id = db.Column(db.String(100), nullable=True)
     
     # Relationships
-    conversations = db.relationship('Conversation', backref='user', lazy=True, cascade="all, delete-orphan")
+    # Skill ratings keyed by skill name; new users get DEFAULT_SKILLS on insert
+    skills = db.relationship('UserSkill', back_populates='user', lazy='select', cascade="all, delete-orphan",
+                             collection_class=attribute_keyed_dict('skill'))
+    
+    # Loaded on access only; the user is loaded on every request
+    conversations = db.relationship('Conversation', back_populates='user', lazy='select', cascade="all, delete-orphan")
     
     def set_password(self, password):
         """Set password hash."""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = run_off_loop(password_hasher.hash, password)
     
     def check_password(self, password):
-        """Check password against stored hash."""
-        return check_password_hash(self.password_hash, password)
+        """Check password against stored hash, upgrading outdated hashes."""
+        if not verify_password_hash(self.password_hash, password):
+            return False
+        
+        if password_needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
     
-    @property
-    def skills_dict(self):
-        """Get sales skills as dictionary."""
-        try:
-            return json.loads(self.sales_skills)
-        except:
-            return {
-                "rapport_building": 0,
-                "needs_discovery": 0,
-                "objection_handling": 0,
-                "closing": 0,
-                "product_knowledge": 0
-            }
-    
-    @skills_dict.setter
-    def skills_dict(self, value):
-        """Set sales skills from dictionary."""
-        self.sales_skills = json.dumps(value)
-    
-    @property
-    def strengths_list(self):
-        """Get strengths as list."""
-        try:
-            return json.loads(self.strengths)
-        except:
-            return []
-    
-    @strengths_list.setter
-    def strengths_list(self, value):
-        """Set strengths from list."""
-        self.strengths = json.dumps(value)
-    
-    @property
-    def weaknesses_list(self):
-        """Get weaknesses as list."""
-        try:
-            return json.loads(self.weaknesses)
-        except:
-            return []
+    def __repr__(self):
+        return f'<User {self.email}>'
+
+
+class UserSkill(db.Model):
+    """A user's rating for a single sales skill."""
+    
+    __tablename__ = 'user_skill'
     
-    @weaknesses_list.setter
-    def weaknesses_list(self, value):
-        """Set weaknesses from list."""
-        self.weaknesses = json.dumps(value)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    skill = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.SmallInteger, nullable=False, default=0)
+    
+    # Skills are always loaded through their user
+    user = db.relationship('User', back_populates='skills', lazy='raise')
     
     def __repr__(self):
-        return f'<User {self.email}>'
+        return f'<UserSkill {self.user_id}: {self.skill}={self.value}>'
+
+@event.listens_for(User, 'after_insert')
+def add_default_skills(mapper, connection, user):
+    """Give a newly created user the default skill ratings in one bulk INSERT."""
+    connection.execute(UserSkill.__table__.insert(), [
+        {'user_id': user.id, 'skill': skill, 'value': value}
+        for skill, value in DEFAULT_SKILLS.items()
+    ])
 
 
 class Conversation(db.Model):
@@ -100,8 +292,9 @@ class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(200), default="New Conversation")
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, server_default=func.current_timestamp(), nullable=False)
+    updated_at = db.Column(db.DateTime, server_default=func.current_timestamp(),
+                           onupdate=func.current_timestamp(), nullable=False)
     
     # Sales context information
     product_service = db.Column(db.Text, nullable=True)
@@ -111,8 +304,22 @@ class Conversation(db.Model):
     # AI persona for this conversation
     persona = db.Column(db.Text, nullable=True)
     
+    # Rolling summary of the messages older than the verbatim window
+    summary = db.Column(db.Text, nullable=True)
+    summarized_count = db.Column(db.Integer, default=0, nullable=False)
+    
+    # Serves a user's conversation list, newest first, straight from the index
+    __table_args__ = (
+        db.Index('ix_conversation_user_updated', user_id, updated_at.desc()),
+    )
+    
     # Relationships
-    messages = db.relationship('Message', backref='conversation', lazy=True, cascade="all, delete-orphan")
+    # Loaded on access only; views that render the transcript use selectinload
+    messages = db.relationship('Message', back_populates='conversation', lazy='select', cascade="all, delete-orphan",
+                               order_by='Message.timestamp')
+    
+    # Nothing reads the owner through the relationship; routes filter on user_id
+    user = db.relationship('User', back_populates='conversations', lazy='raise')
     
     def __repr__(self):
         return f'<Conversation {self.id}: {self.title}>'
@@ -124,8 +331,22 @@ class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # 'user' or 'assistant'
-    content = db.Column(db.Text, nullable=False)
+    content = db.Column(CompressedText, nullable=False)
+    # Set in Python for sub-second precision; history is ordered by it and
+    # a reply usually lands in the same second as the message it answers
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Messages are always loaded through their conversation
+    conversation = db.relationship('Conversation', back_populates='messages', lazy='raise')
+    
+    # Serves "latest N messages of a conversation" straight from the index
+    __table_args__ = (
+        db.Index('ix_message_conv_ts', conversation_id, timestamp.desc()),
+    )
+    
     def __repr__(self):
-        return f'<Message {self.id}: {self.role}>'
\ No newline at end of file
+        return f'<Message {self.id}: {self.role}>'
+
+if __name__ == '__main__':
+    # Print the time cost to pin in ARGON2_TIME_COST for this hardware
+    print(f"ARGON2_TIME_COST={calibrate_time_cost()}")
@@ -0,0 +1,17 @@
+"""
+Redis connection for the Sales Training AI application.
+
+This module provides a single pooled Redis client shared by everything in the
+process that needs state visible to all workers (rate limiting, caching).
+"""
+import redis
+from config_manager import config
+
+# Shared connection pool for this process
+pool = redis.ConnectionPool.from_url(
+    config.get('REDIS_URL'),
+    max_connections=config.get('REDIS_MAX_CONNECTIONS', 50)
+)
+
+# Client used across the application
+redis_client = redis.Redis(connection_pool=pool)
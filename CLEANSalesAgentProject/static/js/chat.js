@@ -22,6 +22,8 @@ function handleSendMessage(e) {
     messageInput.style.height = 'auto';
     
     // Send message to server
+    let streamingElement = null;
+    let streamedText = '';
     fetch(`/chat/${currentConversationId}/message`, {
         method: 'POST',
         headers: {
@@ -30,8 +32,32 @@ function handleSendMessage(e) {
         },
         body: JSON.stringify({ message: messageText })
     })
-    .then(response => response.json())
+    .then(response => {
+        // Errors before streaming starts come back as plain JSON
+        if (!(response.headers.get('Content-Type') || '').includes('text/event-stream')) {
+            return response.json();
+        }
+        
+        // Show the reply as it arrives
+        return readMessageStream(response, delta => {
+            if (!streamingElement) {
+                streamingElement = addMessage({
+                    role: 'assistant',
+                    content: '',
+                    timestamp: new Date().toISOString()
+                });
+            }
+            streamedText += delta;
+            streamingElement.querySelector('.message-content').textContent = streamedText;
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        });
+    })
     .then(data => {
+        // Replace the live preview with the formatted message
+        if (streamingElement) {
+            streamingElement.remove();
+        }
+        
         // Re-enable input
         messageInput.disabled = false;
         isWaitingForResponse = false;
@@ -81,6 +107,39 @@ function handleSendMessage(e) {
     });
 }
 
+// Read a Server-Sent Events response, passing text deltas to onDelta and
+// resolving with the final status event
+function readMessageStream(response, onDelta) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = { status: 'error', error: 'Connection closed before the response finished' };
+
+    function pump() {
+        return reader.read().then(({ done, value }) => {
+            if (done) return result;
+
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+
+            events.forEach(event => {
+                if (!event.startsWith('data: ')) return;
+                const payload = JSON.parse(event.slice(6));
+                if (payload.delta !== undefined) {
+                    onDelta(payload.delta);
+                } else {
+                    result = payload;
+                }
+            });
+
+            return pump();
+        });
+    }
+
+    return pump();
+}
+
 // Function to request feedback for current conversation
 function requestFeedback() {
     if (!currentConversationId || feedbackBtn.disabled) return;
@@ -172,6 +231,8 @@ function addMessage(message) {
     setTimeout(() => {
         messageElement.classList.add('visible');
     }, 10);
+    
+    return messageElement;
 }
 
 // Function to update status indicator
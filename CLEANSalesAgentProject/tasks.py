@@ -0,0 +1,144 @@
+"""
+Background tasks for the Sales Training AI application.
+
+Work that doesn't need to finish before a response is returned is pushed onto
+an RQ queue in Redis. Run a worker alongside the web processes with:
+
+    rq worker --url $REDIS_URL
+"""
+import logging
+from contextlib import nullcontext
+import redis
+from rq import Queue
+from flask import has_app_context
+from redis_client import redis_client
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Queue shared by the web processes and the worker
+task_queue = Queue('default', connection=redis_client)
+
+_app = None
+
+def _app_context():
+    """
+    Return an app context for running a task.
+
+    Inside a request (inline fallback) the existing context is reused; in the
+    worker a single app is created on first use.
+    """
+    global _app
+    if has_app_context():
+        return nullcontext()
+    if _app is None:
+        from app import create_app
+        _app = create_app()
+    return _app.app_context()
+
+# A queued summary holds this key so later turns don't queue duplicates; it
+# expires in case a worker dies mid-job
+SUMMARY_JOB_TTL = 10 * 60
+
+def summary_job_key(conversation_id):
+    """Redis key marking a queued summary for a conversation."""
+    return f"conv:{conversation_id}:summary_job"
+
+def enqueue(func, *args):
+    """
+    Queue a task, running it inline if Redis is unavailable.
+
+    Args:
+        func: The task function
+        *args: Arguments for the task
+    """
+    try:
+        task_queue.enqueue(func, *args)
+    except redis.RedisError as e:
+        logger.warning(f"Task queue unavailable, running {func.__name__} inline: {e}")
+        func(*args)
+
+def enqueue_summary(conversation_id, upto):
+    """
+    Queue a summary for a conversation unless one is already queued.
+
+    Summaries are optional, so unlike enqueue nothing runs inline when Redis is
+    unavailable; a later turn queues it again.
+
+    Args:
+        conversation_id: ID of the conversation to summarize
+        upto: Number of messages, from the start, the summary should cover
+    """
+    try:
+        if redis_client.set(summary_job_key(conversation_id), upto, nx=True, ex=SUMMARY_JOB_TTL):
+            task_queue.enqueue(summarize_conversation_task, conversation_id, upto)
+    except redis.RedisError as e:
+        logger.warning(f"Task queue unavailable, skipping summary of conversation {conversation_id}: {e}")
+
+def update_user_stats_task(user_id, feedback):
+    """
+    Apply conversation feedback to a user's stats.
+
+    Args:
+        user_id: ID of the user who completed the roleplay
+        feedback: Feedback text generated for the conversation
+    """
+    from models import db, User
+    from chat_routes import update_user_stats
+
+    with _app_context():
+        user = db.session.get(User, user_id)
+        if user is None:
+            logger.warning(f"Skipping stats update for missing user {user_id}")
+            return
+
+        # Update user's stats based on feedback
+        update_user_stats(user, feedback)
+
+        # Increment completed roleplays
+        user.completed_roleplays += 1
+        db.session.commit()
+
+def summarize_conversation_task(conversation_id, upto):
+    """
+    Fold older messages of a conversation into its rolling summary.
+
+    Args:
+        conversation_id: ID of the conversation to summarize
+        upto: Number of messages, from the start, the summary should cover
+    """
+    try:
+        with _app_context():
+            _summarize_conversation(conversation_id, upto)
+    finally:
+        # Let the next turn queue a summary again
+        try:
+            redis_client.delete(summary_job_key(conversation_id))
+        except redis.RedisError as e:
+            logger.warning(f"Could not clear summary job marker: {e}")
+
+def _summarize_conversation(conversation_id, upto):
+    """Summarize a conversation inside an app context."""
+    from models import db, Conversation, Message
+    from claude_service import get_claude_service
+
+    conversation = db.session.get(Conversation, conversation_id)
+    if conversation is None:
+        logger.warning(f"Skipping summary for missing conversation {conversation_id}")
+        return
+
+    # Another run may already have covered these messages
+    start = conversation.summarized_count or 0
+    if upto <= start:
+        return
+
+    messages = Message.query.filter_by(conversation_id=conversation_id).order_by(
+        Message.timestamp
+    ).offset(start).limit(upto - start).all()
+
+    conversation.summary = get_claude_service().generate_conversation_summary(
+        [{'role': msg.role, 'content': msg.content} for msg in messages],
+        conversation.summary
+    )
+    conversation.summarized_count = upto
+    db.session.commit()
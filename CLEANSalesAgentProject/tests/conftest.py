@@ -0,0 +1,62 @@
+"""
+Shared fixtures for the Sales Training AI tests.
+
+The route modules live in hyphenated files, so they are registered under the
+names app.py imports before anything else is loaded, and the shared Redis
+client is swapped for an in-memory fake.
+"""
+import importlib.util
+import os
+import sys
+from functools import partial
+
+import fakeredis
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('FLASK_SECRET_KEY', 'test-secret-key-for-the-suite-only')
+os.environ.setdefault('ANTHROPIC_API_KEY', 'test-key')
+
+import redis_client  # noqa: E402
+redis_client.redis_client = fakeredis.FakeRedis()
+
+for name, filename in [('auth_routes', 'auth-routes-py.py'), ('chat_routes', 'chat-routes.py')]:
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+
+import app as app_module  # noqa: E402
+from models import db, User  # noqa: E402
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App with its SQLite database in a temporary instance folder."""
+    monkeypatch.setattr(app_module, 'Flask', partial(app_module.Flask, instance_path=str(tmp_path)))
+    app = app_module.create_app()
+    app.config['SESSION_COOKIE_SECURE'] = False
+    with app.app_context():
+        db.create_all()
+    yield app
+    redis_client.redis_client.flushall()
+
+@pytest.fixture
+def user(app):
+    """A registered user."""
+    with app.app_context():
+        user = User(name='Test', email='test@example.com', password_hash='unused')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+@pytest.fixture
+def client(app, user):
+    """Test client logged in as the user, with a known CSRF token."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user)
+        session['_fresh'] = True
+        session['_csrf_token'] = 'test-csrf-token'
+    client.environ_base['HTTP_X_CSRF_TOKEN'] = 'test-csrf-token'
+    return client
@@ -0,0 +1,18 @@
+"""Tests for the authentication routes."""
+
+def test_login_rate_limit_serves_429_page(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_csrf_token'] = 'test-csrf-token'
+    client.environ_base['HTTP_X_CSRF_TOKEN'] = 'test-csrf-token'
+    
+    # A different address each time so the account lockout doesn't kick in first
+    for i in range(5):
+        credentials = {'email': f'nobody{i}@example.com', 'password': 'wrong-password'}
+        assert client.post('/auth/login', json=credentials).status_code == 401
+    response = client.post('/auth/login', json={'email': 'nobody@example.com', 'password': 'wrong-password'})
+    
+    # The header and the countdown on the page both use the limiter's wait
+    assert response.status_code == 429
+    assert 0 < int(response.headers['Retry-After']) <= 300
+    assert f'>{response.headers["Retry-After"]}</span>' in response.get_data(as_text=True)
@@ -0,0 +1,91 @@
+"""Tests for the streamed chat endpoint."""
+import json
+from contextlib import contextmanager
+
+import pytest
+
+import chat_routes
+from claude_service import get_claude_service
+from models import db, Conversation, Message
+from redis_client import redis_client
+
+@pytest.fixture
+def conversation(app, user):
+    """A conversation whose persona is already set up."""
+    with app.app_context():
+        conversation = Conversation(
+            user_id=user,
+            persona='A busy procurement manager',
+            product_service='CRM software',
+            target_market='B2B',
+            sales_experience='2 years'
+        )
+        db.session.add(conversation)
+        db.session.commit()
+        return conversation.id
+
+@pytest.fixture
+def claude_stream(monkeypatch):
+    """Replace the Claude streaming call; set .chunks to the reply pieces."""
+    calls = []
+    
+    @contextmanager
+    def stream(**kwargs):
+        calls.append(kwargs)
+        yield type('FakeStream', (), {'text_stream': iter(stream.chunks)})()
+    
+    stream.chunks = []
+    stream.calls = calls
+    monkeypatch.setattr(get_claude_service().client.messages, 'stream', stream)
+    return stream
+
+def read_events(response):
+    """Decode the Server-Sent Events in a streamed response."""
+    body = response.get_data(as_text=True)
+    return [json.loads(line[len('data: '):]) for line in body.split('\n\n') if line]
+
+def test_send_message_streams_and_saves_reply(app, client, conversation, claude_stream):
+    claude_stream.chunks = ['Hello', ' there']
+    
+    response = client.post(f'/chat/{conversation}/message', json={'message': 'Hi'})
+    
+    events = read_events(response)
+    assert [e.get('delta') for e in events[:-1]] == ['Hello', ' there']
+    assert events[-1]['status'] == 'success'
+    assert events[-1]['message']['content'] == 'Hello there'
+    with app.app_context():
+        messages = Message.query.filter_by(conversation_id=conversation).order_by(Message.id).all()
+        assert [(m.role, m.content) for m in messages] == [('user', 'Hi'), ('assistant', 'Hello there')]
+
+def test_send_message_extends_cached_history(app, client, conversation, claude_stream):
+    claude_stream.chunks = ['First reply']
+    client.post(f'/chat/{conversation}/message', json={'message': 'One'})
+    
+    # The second turn loads the window cached by the first and appends to it
+    claude_stream.chunks = ['Second reply']
+    response = client.post(f'/chat/{conversation}/message', json={'message': 'Two'})
+    
+    assert read_events(response)[-1]['status'] == 'success'
+    cached = [json.loads(item) for item in redis_client.lrange(chat_routes.history_key(conversation), 0, -1)]
+    assert cached == [
+        {'role': 'user', 'content': 'One'},
+        {'role': 'assistant', 'content': 'First reply'},
+        {'role': 'user', 'content': 'Two'},
+        {'role': 'assistant', 'content': 'Second reply'},
+    ]
+    assert claude_stream.calls[-1]['messages'][:2] == cached[:2]
+
+def test_send_message_drops_reply_when_stream_fails(app, client, conversation, claude_stream):
+    def broken_stream():
+        yield 'Partial'
+        raise RuntimeError('connection reset')
+    claude_stream.chunks = broken_stream()
+    
+    response = client.post(f'/chat/{conversation}/message', json={'message': 'Hi'})
+    
+    events = read_events(response)
+    assert events[-1]['status'] == 'error'
+    assert all(e.get('status') != 'success' for e in events)
+    with app.app_context():
+        messages = Message.query.filter_by(conversation_id=conversation).all()
+        assert [(m.role, m.content) for m in messages] == [('user', 'Hi')]